@@ -61,3 +61,22 @@ def plot_macronutrients(protein, carbs, fats):
 
     fig = px.pie(values=values, names=labels, title="Distribución de Macros")
     return fig
+
+def plot_adherence_trend(trend_df):
+    """
+    Plots the rolling adherence score over time.
+    """
+    if trend_df.empty:
+        return None
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=trend_df.index, y=trend_df["adherence"], mode="lines", name="Adherencia", line=dict(color='#636EFA')))
+    fig.add_hline(y=75, line_dash="dot", annotation_text="Alto (75%)", annotation_position="bottom right")
+
+    fig.update_layout(
+        title="Tendencia de Adherencia (7 días móviles)",
+        xaxis_title="Fecha",
+        yaxis_title="%",
+        yaxis_range=[0, 100]
+    )
+    return fig
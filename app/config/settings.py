@@ -1,6 +1,64 @@
 import os
 import streamlit as st
 
+# Storage
+# "sheets" (default): read and write Google Sheets directly
+# "local": embedded SQLite store, mirrored to Google Sheets in the background when configured.
+#   Opt-in: DATA_DIR must be persistent storage shared by every instance, not a
+#   container's ephemeral disk (each instance would see its own data)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sheets")
+SHEETS_MIRROR = os.environ.get("SHEETS_MIRROR", "1") == "1"
+DATA_DIR = os.environ.get(
+    "HEALTH_TRACKER_DATA_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'data'))
+)
+# "1" when DATA_DIR is on a persistent volume
+DATA_DIR_PERSISTENT = os.environ.get("HEALTH_TRACKER_DATA_PERSISTENT", "0") == "1"
+LOCAL_DB_PATH = os.path.join(DATA_DIR, "health_tracker.db")
+# Durable queue of appends waiting to be written to Google Sheets
+JOURNAL_DB_PATH = os.path.join(DATA_DIR, "sheets_journal.db")
+
+# Cache tier shared across replicas: "" = SQLite file below, "redis://..." = Redis, "off" = disabled
+SHARED_CACHE_URL = os.environ.get("SHARED_CACHE_URL", "")
+SHARED_CACHE_PATH = os.path.join(DATA_DIR, "shared_cache.db")
+# Capped at the 60 s in-process TTL of worksheet data
+SHARED_CACHE_TTL_SECONDS = 60
+
+# Persistent cache of AI coach messages (point it at a shared volume to share it across replicas)
+FEEDBACK_CACHE_PATH = os.environ.get("FEEDBACK_CACHE_PATH", os.path.join(DATA_DIR, "feedback_cache.db"))
+FEEDBACK_CACHE_TTL_SECONDS = 24 * 3600
+FEEDBACK_CACHE_MAX_ENTRIES = 1000
+
+# Meal photo analysis: if the current Gemini model hasn't answered after the
+# hedge delay, the next model is queried in parallel; the whole scan gives up at the deadline
+GEMINI_HEDGE_DELAY_SECONDS = float(os.environ.get("GEMINI_HEDGE_DELAY_SECONDS", "4"))
+GEMINI_DEADLINE_SECONDS = float(os.environ.get("GEMINI_DEADLINE_SECONDS", "30"))
+# "1": JSON output constrained by a compact response schema; "0": free-text JSON prompt
+GEMINI_STRUCTURED_OUTPUT = os.environ.get("GEMINI_STRUCTURED_OUTPUT", "1") == "1"
+
+# Photo analysis results, reused for the same photo (exact perceptual hash)
+IMAGE_CACHE_TTL_SECONDS = 24 * 3600
+IMAGE_CACHE_MAX_ENTRIES = 256
+
+# Meal photos are shrunk and re-encoded before being shown or analyzed
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", "1024"))
+IMAGE_FORMAT = os.environ.get("IMAGE_FORMAT", "JPEG")  # JPEG or WEBP
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "85"))
+
+# Local pre-filter before Gemini (YOLO + photo quality): rejects dark, blurry or
+# clearly non-food photos and answers confident single-food photos on its own
+PREFILTER_ENABLED = os.environ.get("PREFILTER_ENABLED", "1") == "1"
+PREFILTER_IMGSZ = 320  # YOLO input size for the quick pass
+PREFILTER_MIN_BRIGHTNESS = 35  # mean luminance, 0-255
+PREFILTER_MIN_SHARPNESS = 25  # variance of the Laplacian at 256 px
+PREFILTER_LOCAL_CONFIDENCE = 0.8  # single known food answered locally from here
+PREFILTER_REJECT_CONFIDENCE = 0.6  # non-food objects needed to reject a photo
+
+# Google Sheets API quota (per user ~60 requests/min; keep some headroom)
+SHEETS_REQUESTS_PER_MINUTE = int(os.environ.get("SHEETS_REQUESTS_PER_MINUTE", "55"))
+# Share of the bucket background syncs must leave for page renders
+SHEETS_INTERACTIVE_RESERVE = 0.2
+
 # Sheet Names
 SHEET_BODY_METRICS = "body_metrics"
 SHEET_NUTRITION_LOG = "nutrition_log"
@@ -21,21 +79,53 @@ ALL_SHEETS = [
 ]
 
 # Column Definitions
-COLS_BODY = ["date", "weight", "body_fat_percentage", "waist", "hip", "chest", "arms", "thighs", "notes"]
-COLS_NUTRITION = ["date", "calories", "protein", "carbs", "fats", "notes"]
-COLS_WATER = ["date", "amount_ml", "goal_ml"]
+# Every sheet ends with a client-generated row id so retried appends can be de-duplicated
+ROW_ID = "row_id"
+
+COLS_BODY = ["date", "weight", "body_fat_percentage", "waist", "hip", "chest", "arms", "thighs", "notes", ROW_ID]
+COLS_NUTRITION = ["date", "calories", "protein", "carbs", "fats", "notes", ROW_ID]
+COLS_WATER = ["date", "amount_ml", "goal_ml", ROW_ID]
 COLS_MEDS = [
     "date", "dose_mg", "time_taken", "appetite_level", "energy_level", 
-    "heart_rate", "blood_pressure", "sleep_quality", "side_effects", "adherence", "notes"
+    "heart_rate", "blood_pressure", "sleep_quality", "side_effects", "adherence", "notes", ROW_ID
 ]
-COLS_HABITS = ["date", "habit_name", "status", "notes"]
-COLS_GOALS = ["category", "metric", "target_value", "start_date", "target_date", "status"]
+COLS_HABITS = ["date", "habit_name", "status", "notes", ROW_ID]
+COLS_GOALS = ["category", "metric", "target_value", "start_date", "target_date", "status", ROW_ID]
 COLS_PROFILE = [
     "name", "age", "gender", "height", "current_weight", "goal_weight", 
     "activity_level", "calorie_deficit", "daily_calories", "tdee", 
-    "updated_at", "start_date", "peso_inicial", "proteina_objetivo", "fecha_objetivo_estimada"
+    "updated_at", "start_date", "peso_inicial", "proteina_objetivo", "fecha_objetivo_estimada", ROW_ID
 ]
 
+SHEET_SCHEMAS = {
+    SHEET_BODY_METRICS: COLS_BODY,
+    SHEET_NUTRITION_LOG: COLS_NUTRITION,
+    SHEET_WATER_LOG: COLS_WATER,
+    SHEET_MEDICATION_LOG: COLS_MEDS,
+    SHEET_HABITS_LOG: COLS_HABITS,
+    SHEET_GOALS: COLS_GOALS,
+    SHEET_PROFILE: COLS_PROFILE
+}
+
+# Column types, applied once when a worksheet is loaded (see services/schema.py).
+# Undeclared columns are loaded as text; the profile and goals sheets stay untyped.
+DATE_FORMAT = "%Y-%m-%d"
+SHEET_DTYPES = {
+    SHEET_BODY_METRICS: {
+        "date": "date", "weight": "float32", "body_fat_percentage": "float32", "waist": "float32",
+        "hip": "float32", "chest": "float32", "arms": "float32", "thighs": "float32"
+    },
+    SHEET_NUTRITION_LOG: {
+        "date": "date", "calories": "float32", "protein": "float32", "carbs": "float32", "fats": "float32"
+    },
+    SHEET_WATER_LOG: {"date": "date", "amount_ml": "int32", "goal_ml": "int32"},
+    SHEET_MEDICATION_LOG: {
+        "date": "date", "dose_mg": "float32", "appetite_level": "float32", "energy_level": "float32",
+        "heart_rate": "float32", "sleep_quality": "float32", "adherence": "bool"
+    },
+    SHEET_HABITS_LOG: {"date": "date", "habit_name": "category", "status": "category"}
+}
+
 # Default Goals (fallback)
 DEFAULT_CALORIE_GOAL = 2000
 DEFAULT_WATER_GOAL = 2500
@@ -1,31 +1,65 @@
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
 import streamlit as st
+from app.services import feedback_cache
 
-@st.cache_data(ttl=3600)
-def generate_coach_feedback(phase, adherence_level, weight_change, risk_flags, name):
+MODEL_NAME = 'gemini-1.5-flash'
+# Bump when the prompt changes so cached messages from the old prompt are not reused
+PROMPT_VERSION = 1
+# Weight changes are rounded to this step in the cache key and the prompt
+WEIGHT_BUCKET_KG = 0.5
+FALLBACK_MESSAGE = "Sigue adelante, cada día cuenta."
+# How long the dashboard waits for the AI message before showing the local one
+COACH_TIMEOUT_SECONDS = 8
+# After a failed generation, serve the local message for a while instead of retrying on every rerun
+RETRY_AFTER_SECONDS = 300
+
+@st.cache_resource
+def get_model(api_key):
     """
-    Generates a personalized motivational message using Gemini.
-    Cached resource to avoid re-generating on every rerun if inputs are same? 
-    Streamlit cache usually works on function args.
+    Configures the SDK and builds the text model once per process.
     """
-    api_key = st.secrets.get("GOOGLE_API_KEY")
-    if not api_key:
-        return "Configura tu API Key para recibir feedback inteligente."
-        
     genai.configure(api_key=api_key)
-    
     # Select model (lightweight is fine for text)
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    
-    prompt = f"""
+    return genai.GenerativeModel(MODEL_NAME)
+
+def _bucket_percent(match):
+    return f"{int(match.group(1)) // 10 * 10}%"
+
+def coaching_signature(phase, adherence_level, weight_change, risk_flags, name):
+    """
+    Normalized coaching state: everything the message depends on, bucketed so
+    that practically identical states share one cached message.
+    """
+    try:
+        weight_change = float(weight_change)
+    except (TypeError, ValueError):
+        weight_change = 0.0
+    bucket = round(weight_change / WEIGHT_BUCKET_KG) * WEIGHT_BUCKET_KG
+    return {
+        "version": PROMPT_VERSION,
+        "model": MODEL_NAME,
+        "name": str(name).strip(),
+        "phase": str(phase),
+        "adherence_level": str(adherence_level),
+        "weight_change": bucket + 0.0,  # no "-0.0"
+        # "Adherencia crítica (67%)" -> "(60%)"
+        "risk_flags": sorted({re.sub(r"(\d+)%", _bucket_percent, str(flag)) for flag in risk_flags or []}),
+    }
+
+def _build_prompt(signature):
+    return f"""
     Actúa como un entrenador personal de élite y experto en psicología del comportamiento.
-    Tu cliente, {name}, está en un proceso de transformación física.
+    Tu cliente, {signature['name']}, está en un proceso de transformación física.
     
     ESTADO ACTUAL:
-    - Fase Fisiológica: {phase}
-    - Nivel de Adherencia Semanal: {adherence_level} (Escala: ÉLITE, ALTO, MEDIO, RIESGO)
-    - Cambio de Peso Reciente: {weight_change} kg
-    - Alertas de Riesgo Detectadas: {', '.join(risk_flags) if risk_flags else 'Ninguna'}
+    - Fase Fisiológica: {signature['phase']}
+    - Nivel de Adherencia Semanal: {signature['adherence_level']} (Escala: ÉLITE, ALTO, MEDIO, RIESGO)
+    - Cambio de Peso Reciente: {signature['weight_change']:+.1f} kg (aprox.)
+    - Alertas de Riesgo Detectadas: {', '.join(signature['risk_flags']) if signature['risk_flags'] else 'Ninguna'}
     
     OBJETIVO:
     Genera un mensaje corto (max 2 frases) de feedback.
@@ -38,9 +72,173 @@ def generate_coach_feedback(phase, adherence_level, weight_change, risk_flags, n
     - Habla en español, tono motivador y profesional.
     - NO uses saludos genéricos como "Hola". Ve directo al grano.
     """
-    
+
+def local_feedback(phase, adherence_level, weight_change, risk_flags, name):
+    """
+    Templated coach message, used when the AI is unavailable or too slow.
+    """
+    first_name = str(name).split()[0] if str(name).strip() else "Atleta"
+    by_level = {
+        "ÉLITE": f"{first_name}, semana de nivel élite: esta constancia es la que transforma el cuerpo. Sigue exactamente así.",
+        "ALTO": f"{first_name}, vas muy bien: mantén el ritmo y asegura la proteína de hoy.",
+        "MEDIO": f"{first_name}, vas por buen camino pero hay margen: elige un pilar que ajustar hoy y cúmplelo.",
+        "RIESGO": f"{first_name}, no te rindas: un día no define el proceso, ajusta hoy con la siguiente comida.",
+    }
+    message = by_level.get(adherence_level, by_level["MEDIO"])
+    if risk_flags:
+        focus = str(risk_flags[0]).replace("⚠️", "").strip()
+        message += f" Prioridad: {focus}."
+    elif phase:
+        message += f" Estás en fase de {phase}."
+    return message
+
+class CoachFeedback:
+    """
+    Handle to a coach message that may still be generating in the background.
+    Chunks are kept, so any number of renders can stream the same message.
+    """
+    def __init__(self, fallback, text=None):
+        self.fallback = fallback
+        self.started_at = time.time()
+        self.finished_at = self.started_at if text is not None else None
+        self.failed = False
+        self._chunks = [text] if text is not None else []
+        self._cond = threading.Condition()
+
+    @property
+    def done(self):
+        return self.finished_at is not None
+
+    @property
+    def text(self):
+        """
+        The full message once done (the local one if generation failed), else None.
+        """
+        if not self.done:
+            return None
+        return self.fallback if self.failed else "".join(self._chunks)
+
+    def _push(self, chunk):
+        with self._cond:
+            self._chunks.append(chunk)
+            self._cond.notify_all()
+
+    def _finish(self, text=None, failed=False):
+        with self._cond:
+            if text is not None and not self._chunks:
+                # Generated elsewhere (another rerun or instance): nothing was streamed here
+                self._chunks = [text]
+            self.failed = failed
+            self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def stream(self, timeout=None):
+        """
+        Yields the message chunks as they arrive, until the message is
+        complete or `timeout` seconds have passed since the request.
+        """
+        deadline = self.started_at + (COACH_TIMEOUT_SECONDS if timeout is None else timeout)
+        sent = 0
+        while True:
+            with self._cond:
+                while sent == len(self._chunks) and not self.done:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return
+                    self._cond.wait(remaining)
+                chunks = self._chunks[sent:]
+                finished = self.done
+            if self.failed:
+                return
+            for chunk in chunks:
+                yield chunk
+            sent += len(chunks)
+            if finished:
+                return
+
+    def result(self, timeout=None):
+        """
+        Blocks until done (at most `timeout` seconds since the request).
+        Returns the message, or the local one on failure/timeout.
+        """
+        deadline = self.started_at + (COACH_TIMEOUT_SECONDS if timeout is None else timeout)
+        with self._cond:
+            self._cond.wait_for(lambda: self.done, max(0.0, deadline - time.time()))
+        return self.text or self.fallback
+
+@st.cache_resource
+def get_executor():
+    """
+    Background workers for coach generation (shared by every session).
+    """
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="coach")
+
+# In-flight (and recently failed) generations per cache key, so reruns attach
+# to the running job instead of starting another one
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def _generate(api_key, signature, key, job):
+    # Whether create() ran, and what it produced
+    created = {"ran": False, "text": None}
+
+    def create():
+        created["ran"] = True
+        try:
+            response = get_model(api_key).generate_content(_build_prompt(signature), stream=True)
+            for chunk in response:
+                if chunk.text:
+                    job._push(chunk.text)
+            created["text"] = "".join(job._chunks).strip() or None
+        except Exception as e:
+            print(f"Coach feedback generation failed: {e}")
+        return created["text"]
+
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        try:
+            text = feedback_cache.get_or_create(key, create)
+        except Exception as e:
+            # Cache unavailable (e.g. read-only disk, locked database): still
+            # answer, without paying for (and streaming) the message twice
+            print(f"Feedback cache unavailable: {e}")
+            text = created["text"] if created["ran"] else create()
+        if text is None:
+            job._finish(failed=True)
+        else:
+            job._finish(text)
+    finally:
+        with _jobs_lock:
+            if not job.failed:
+                _jobs.pop(key, None)
+
+def request_coach_feedback(phase, adherence_level, weight_change, risk_flags, name):
+    """
+    Returns a CoachFeedback right away: already complete when the message is
+    cached, otherwise generating in the background (see CoachFeedback.stream).
+    Messages are cached on disk per coaching state (see coaching_signature),
+    shared by every instance, so the same state is only generated once.
+    """
+    fallback = local_feedback(phase, adherence_level, weight_change, risk_flags, name)
+    api_key = st.secrets.get("GOOGLE_API_KEY")
+    if not api_key:
+        return CoachFeedback(fallback, text="Configura tu API Key para recibir feedback inteligente.")
+
+    signature = coaching_signature(phase, adherence_level, weight_change, risk_flags, name)
+    key = feedback_cache.make_key(signature)
+    try:
+        cached = feedback_cache.get(key)
     except Exception as e:
-        return "Sigue adelante, cada día cuenta."
+        print(f"Feedback cache unavailable: {e}")
+        cached = None
+    if cached is not None:
+        return CoachFeedback(fallback, text=cached)
+
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is not None and job.failed and time.time() - job.finished_at > RETRY_AFTER_SECONDS:
+            job = None
+        if job is None:
+            job = CoachFeedback(fallback)
+            _jobs[key] = job
+            get_executor().submit(_generate, api_key, signature, key, job)
+    return job
@@ -1,6 +1,6 @@
 import streamlit as st
 from datetime import datetime
-from app.services import google_sheets_service as sheets
+from app.services import storage_service as storage
 from app.config import settings
 
 def load_config():
@@ -9,7 +9,7 @@ def load_config():
     Ensures all required fields for the system are present.
     """
     try:
-        df = sheets.load_data(settings.SHEET_PROFILE)
+        df = storage.load_data(settings.SHEET_PROFILE)
         if not df.empty:
             profile = df.iloc[-1].to_dict()
             
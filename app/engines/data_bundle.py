@@ -0,0 +1,53 @@
+from dataclasses import dataclass
+from datetime import datetime
+import pandas as pd
+
+@dataclass(frozen=True)
+class DataBundle:
+    """
+    Everything the engines need for one render, prepared once.
+
+    Log frames are private copies, sorted and indexed by day (DatetimeIndex
+    named 'date', original row order kept within a day). Engines must treat
+    them as read-only. Daily aggregates come from the materialized rollup
+    (see storage_service.load_daily) and are indexed by day as well:
+    - daily: every rollup column, one row per day with anything logged
+    - daily_nutrition: calories, protein, carbs, fats (days with meals only)
+    - daily_water: amount_ml per day (days with water logs only)
+    - daily_habits: elite_completed (count), workout (bool)
+    """
+    today: pd.Timestamp
+    body: pd.DataFrame
+    meds: pd.DataFrame
+    daily: pd.DataFrame
+    daily_nutrition: pd.DataFrame
+    daily_water: pd.Series
+    daily_habits: pd.DataFrame
+
+NUTRITION_COLS = ["calories", "protein", "carbs", "fats"]
+
+def _by_day(df):
+    """
+    Copy of df indexed by its (already parsed) date column, undated rows dropped.
+    """
+    if df.empty or 'date' not in df.columns:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name='date'))
+    out = df[df['date'].notna()].set_index('date')
+    # Stable sort keeps same-day rows in logging order ("last entry wins" logic relies on it)
+    return out.sort_index(kind='mergesort')
+
+def build_bundle(body_df, meds_df, daily_df, today=None):
+    """
+    Builds the DataBundle for one render from the loaded (typed) frames and
+    the daily rollup. The input frames are not modified.
+    """
+    today = pd.Timestamp(today if today is not None else datetime.now().date()).normalize()
+    return DataBundle(
+        today=today,
+        body=_by_day(body_df),
+        meds=_by_day(meds_df),
+        daily=daily_df,
+        daily_nutrition=daily_df.loc[daily_df['meals'] > 0, NUTRITION_COLS],
+        daily_water=daily_df.loc[daily_df['water_logs'] > 0, 'water_ml'].rename('amount_ml'),
+        daily_habits=daily_df[['elite_completed', 'workout']],
+    )
@@ -0,0 +1,168 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+import pandas as pd
+from app.engines import phase_engine, adherence_engine, risk_engine, projection_engine
+
+# Runs the dashboard engines in dependency order and caches each result on a
+# fingerprint of its inputs, so a rerun that changed nothing (e.g. clicking an
+# unrelated button) recomputes nothing, and a new meal only recomputes the
+# engines that read the daily rollup.
+#
+# Inputs are either bundle sources (SOURCES) or the names of earlier engines.
+# An engine must declare every source it reads: undeclared reads are not part
+# of its cache key. Cached results are shared, callers must not modify them.
+
+SOURCES = ("today", "config", "body", "meds", "daily")
+MAX_CACHED_RESULTS = 64
+
+@dataclass(frozen=True)
+class Engine:
+    name: str
+    inputs: tuple
+    run: object  # run(bundle, config, results) -> result
+
+def _coach(bundle, config, results):
+    """
+    Inputs of the AI coach message. The message itself is requested by the
+    page (ai_feedback_engine.request_coach_feedback) so it can stream in
+    without holding back the rest of the dashboard.
+    """
+    phase_name, _ = results["phase"]
+    adherence_level = results["adherence"][7][1]
+    weight_change = 0
+    if not bundle.body.empty:
+        # Passing simple scalar to AI for now
+        current_w = config.get('current_weight', 0)
+        start_w = config.get('peso_inicial', 0)
+        weight_change = round(current_w - start_w, 1)
+    return {
+        "phase": phase_name,
+        "adherence_level": adherence_level,
+        "weight_change": weight_change,
+        "risk_flags": results["risk"],
+        "name": config.get('name', 'Atleta'),
+    }
+
+def _projection(bundle, config, results):
+    model = projection_engine.fit_model(bundle, config)
+    return model, projection_engine.predict_progress(bundle, config, model)
+
+ENGINES = [
+    Engine("phase", ("today", "config"),
+           lambda bundle, config, results: phase_engine.determine_phase(config.get('start_date'))),
+    # 7/30/90 days in one pass; the 7-day window drives the dashboard
+    Engine("adherence", ("today", "config", "daily"),
+           lambda bundle, config, results: adherence_engine.calculate_window_adherence(bundle, config, windows=(7, 30, 90))),
+    Engine("adherence_trend", ("today", "config", "daily"),
+           lambda bundle, config, results: adherence_engine.rolling_adherence(bundle, config)),
+    Engine("risk", ("today", "config", "daily", "body", "adherence"),
+           lambda bundle, config, results: risk_engine.check_dropout_risk(bundle, results["adherence"][7][0], config)),
+    Engine("risk_history", ("today", "config", "daily", "body", "adherence_trend"),
+           lambda bundle, config, results: risk_engine.backtest(bundle, config, results["adherence_trend"]["adherence"])),
+    Engine("projection", ("today", "config", "daily", "body"), _projection),
+    Engine("coach", ("config", "body", "phase", "adherence", "risk"), _coach),
+]
+
+_results = OrderedDict()
+_stats = {}
+_lock = threading.Lock()
+
+def _digest(*parts):
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+def fingerprint(value):
+    """
+    Content hash of an engine input (DataFrame/Series, dict or scalar).
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        if isinstance(value, pd.DataFrame):
+            layout = [f"{col}:{dtype}" for col, dtype in value.dtypes.items()]
+        else:
+            layout = [f"{value.name}:{value.dtype}"]
+        rows = pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes() if len(value) else b""
+        return _digest(type(value).__name__, layout, rows)
+    if isinstance(value, dict):
+        return _digest(*(f"{k}={value[k]!r}" for k in sorted(value, key=str)))
+    return _digest(repr(value))
+
+def _source(bundle, config, name):
+    if name == "config":
+        return config
+    return getattr(bundle, name)
+
+def _record(name, hit, elapsed_ms=0.0):
+    entry = _stats.setdefault(name, {"hits": 0, "misses": 0, "last_ms": 0.0, "total_ms": 0.0})
+    if hit:
+        entry["hits"] += 1
+    else:
+        entry["misses"] += 1
+        entry["last_ms"] = elapsed_ms
+        entry["total_ms"] += elapsed_ms
+
+def run(bundle, config, engines=None):
+    """
+    Runs every engine (in list order, each after its inputs) and returns
+    {engine_name: result}. Engines whose inputs are unchanged since a
+    previous run are served from cache.
+    """
+    engines = ENGINES if engines is None else engines
+    source_keys = {}
+    keys = {}
+    results = {}
+    for engine in engines:
+        input_keys = []
+        for name in engine.inputs:
+            if name in keys:
+                input_keys.append(keys[name])
+            elif name in SOURCES:
+                if name not in source_keys:
+                    source_keys[name] = fingerprint(_source(bundle, config, name))
+                input_keys.append(source_keys[name])
+            else:
+                raise ValueError(f"Engine '{engine.name}' depends on '{name}', which is not a source or an earlier engine")
+        key = _digest(engine.name, *input_keys)
+        keys[engine.name] = key
+
+        with _lock:
+            hit = key in _results
+            if hit:
+                _results.move_to_end(key)
+                results[engine.name] = _results[key]
+                _record(engine.name, True)
+        if hit:
+            continue
+
+        start = time.perf_counter()
+        result = engine.run(bundle, config, results)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        results[engine.name] = result
+        with _lock:
+            _results[key] = result
+            while len(_results) > MAX_CACHED_RESULTS:
+                _results.popitem(last=False)
+            _record(engine.name, False, elapsed_ms)
+    return results
+
+def clear_cache():
+    """
+    Drops every cached engine result (stats are kept).
+    """
+    with _lock:
+        _results.clear()
+
+def stats():
+    """
+    Per-engine cache hits/misses and compute time (ms) of recomputations.
+    """
+    with _lock:
+        return {
+            name: {**entry, "avg_ms": entry["total_ms"] / entry["misses"] if entry["misses"] else 0.0}
+            for name, entry in _stats.items()
+        }
@@ -1,46 +1,181 @@
 from datetime import datetime, timedelta
-import pandas as pd
+import numpy as np
 from app.config import settings
 
-def predict_progress(nutrition_df, config):
+# Weight projection by Monte Carlo simulation.
+# fit_model() estimates, from the whole body_metrics / nutrition history,
+# the usual intake, the maintenance calories (TDEE) and how noisy both are;
+# simulate() runs thousands of weekly trajectories at once, with TDEE
+# adapting as weight drops, and returns the distribution of goal dates.
+
+KCAL_PER_KG = 7700.0
+# Mifflin-St Jeor: BMR changes by 10 kcal per kg, times the activity factor
+BMR_KCAL_PER_KG = 10.0
+# Recent window that defines the "usual" intake
+INTAKE_WINDOW_DAYS = 28
+# Minimum history to trust a TDEE fitted from the data
+MIN_FIT_DAYS = 14
+MIN_FIT_LOGGED_DAYS = 7
+# Fallback uncertainties when the history is too short
+DEFAULT_TDEE_SD = 150.0
+DEFAULT_INTAKE_CV = 0.15
+# Weeks simulated per step; trajectories that reached the goal drop out
+SIM_CHUNK_WEEKS = 13
+
+def _num(value, default):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return float(default)
+    return value if np.isfinite(value) else float(default)
+
+def _daily_weights(bundle):
+    if bundle.body.empty or 'weight' not in bundle.body.columns:
+        return None
+    weights = bundle.body['weight'].astype('float64').dropna()
+    weights = weights[weights > 0]
+    if weights.empty:
+        return None
+    return weights.groupby(level='date').mean()
+
+def fit_model(bundle, config):
     """
-    Predicts weight loss progress based on average REAL calorie deficit over the last 7 days.
+    Fits the projection parameters on the full history.
+    Returns a dict: current_weight, goal_weight, intake, intake_sd (daily),
+    tdee (at current_weight), tdee_sd, tdee_per_kg, fitted (bool).
     """
-    goal_calories = config.get('calorias_objetivo', settings.DEFAULT_CALORIE_GOAL)
-    current_weight = config.get('current_weight', 80.0)
-    goal_weight = config.get('peso_meta', 70.0)
-    configured_deficit = config.get('deficit_calorico', 500)
-    
-    # Calculate real average deficit from last 7 days
-    real_deficit = configured_deficit # Default fallback
-    
-    if not nutrition_df.empty:
-        nutrition_df['date'] = pd.to_datetime(nutrition_df['date'], errors='coerce').dt.date
-        today = datetime.now().date()
-        start_date = today - timedelta(days=6)
-        last_7_days = nutrition_df[nutrition_df['date'] >= start_date]
-        
-        if not last_7_days.empty:
-            avg_consumed = last_7_days.groupby('date')['calories'].sum().mean()
-            real_deficit = goal_calories - avg_consumed
-            
-    # Formula: 7700 kcal = 1kg fat
-    # Ensure positive deficit for calculation, otherwise 0 loss
-    if real_deficit < 0:
-        real_deficit = 0
-        
-    weekly_loss_kg = (real_deficit * 7) / 7700.0
-    
-    remaining_weight = current_weight - goal_weight
-    
-    if remaining_weight <= 0:
-        weeks_needed = 0
-        target_date = datetime.now().date()
-    elif weekly_loss_kg > 0:
-        weeks_needed = remaining_weight / weekly_loss_kg
-        target_date = datetime.now().date() + timedelta(weeks=weeks_needed)
-    else:
-        weeks_needed = 999
-        target_date = None # Never
-        
-    return round(weekly_loss_kg, 2), target_date, int(real_deficit)
+    goal_calories = _num(config.get('calorias_objetivo'), settings.DEFAULT_CALORIE_GOAL)
+    activity = _num(config.get('activity_level'), 1.2)
+    tdee_per_kg = BMR_KCAL_PER_KG * activity
+
+    weights = _daily_weights(bundle)
+    current_weight = float(weights.iloc[-1]) if weights is not None else _num(config.get('current_weight'), 80.0)
+
+    calories = bundle.daily_nutrition['calories'].astype('float64').dropna()
+    recent = calories.loc[bundle.today - timedelta(days=INTAKE_WINDOW_DAYS - 1):bundle.today]
+    intake = float(recent.mean()) if not recent.empty else goal_calories
+    # Day-to-day variance of what is actually eaten
+    intake_sd = float(calories.std()) if len(calories) >= 2 else intake * DEFAULT_INTAKE_CV
+
+    configured_tdee = _num(config.get('tdee'), goal_calories + _num(config.get('deficit_calorico'), 500))
+    tdee, tdee_sd, fitted = configured_tdee, DEFAULT_TDEE_SD, False
+
+    if weights is not None and len(weights) >= 2:
+        days = (weights.index - weights.index[0]).days.to_numpy(dtype='float64')
+        span = days[-1]
+        logged = calories.loc[weights.index[0]:weights.index[-1]]
+        if span >= MIN_FIT_DAYS and len(logged) >= MIN_FIT_LOGGED_DAYS:
+            # Energy balance: TDEE = intake - 7700 * (kg change per day)
+            slope, intercept = np.polyfit(days, weights.to_numpy(), 1)
+            residuals = weights.to_numpy() - (slope * days + intercept)
+            slope_se = np.sqrt(residuals.var(ddof=min(2, len(days) - 1)) / max(((days - days.mean()) ** 2).sum(), 1e-9))
+            mean_weight = float(weights.mean())
+            fitted_tdee = float(logged.mean()) - slope * KCAL_PER_KG
+            # The fit is centered on the average weight of the period
+            tdee = float(fitted_tdee + tdee_per_kg * (current_weight - mean_weight))
+            tdee_sd = float(np.hypot(slope_se * KCAL_PER_KG, intake_sd / np.sqrt(len(logged))))
+            fitted = True
+
+    return {
+        "current_weight": current_weight,
+        "goal_weight": _num(config.get('peso_meta'), 70.0),
+        "intake": intake,
+        "intake_sd": intake_sd,
+        "tdee": tdee,
+        "tdee_sd": tdee_sd,
+        "tdee_per_kg": tdee_per_kg,
+        "fitted": fitted,
+    }
+
+def simulate(model, intake=None, n_sims=2000, horizon_weeks=156, seed=0, today=None):
+    """
+    Simulates n_sims weight trajectories in weekly steps (all at once).
+    intake: daily calories to assume (what-if), defaults to the fitted intake.
+    Each trajectory draws its own TDEE error; each week adds intake noise.
+    Returns a dict with p10/p50/p90 goal dates (None = not reached within
+    the horizon), reach_probability and weekly_loss (expected, first week).
+    """
+    today = today or datetime.now().date()
+    intake = model["intake"] if intake is None else float(intake)
+    start, goal = model["current_weight"], model["goal_weight"]
+    if start <= goal:
+        return {"p10": today, "p50": today, "p90": today, "reach_probability": 1.0, "weekly_loss": 0.0}
+
+    rng = np.random.default_rng(seed)
+    k = model["tdee_per_kg"]
+    tdee = model["tdee"] + rng.normal(0.0, model["tdee_sd"], size=n_sims)
+
+    # Daily: W' - W = (intake - tdee - k (W - start)) / 7700, i.e. the gap to the
+    # equilibrium weight shrinks by a = 1 - k / 7700 per day. Weekly steps:
+    # D[n+1] = A D[n] + E[n] with D = W - equilibrium, A = a^7.
+    a = 1.0 - k / KCAL_PER_KG
+    A = a ** 7
+    equilibrium = start + (intake - tdee) / k
+    week_noise_sd = model["intake_sd"] * np.sqrt((1 - a ** 14) / (1 - a ** 2)) / KCAL_PER_KG
+    powers = A ** np.arange(1, SIM_CHUNK_WEEKS + 1)
+
+    gap = start - equilibrium
+    last_weight = np.full(n_sims, start)
+    weeks = np.full(n_sims, np.inf)
+    # Trajectories settling far above the goal (> 5 sd of the weekly noise
+    # around their equilibrium) never get there: skip them
+    stationary_sd = week_noise_sd / np.sqrt(1 - A ** 2)
+    active = np.flatnonzero(equilibrium - goal <= 5 * stationary_sd)
+    # Quarter by quarter, only for trajectories that haven't reached the goal yet
+    for first_week in range(0, horizon_weeks, SIM_CHUNK_WEEKS):
+        if not len(active):
+            break
+        size = min(SIM_CHUNK_WEEKS, horizon_weeks - first_week)
+        noise = rng.standard_normal((len(active), size)) * week_noise_sd
+        # D[n] = A^n (D[0] + sum_{m<n} A^-(m+1) E[m]) -> one cumsum for every trajectory
+        gaps = powers[:size] * (gap[active, None] + np.cumsum(noise / powers[:size], axis=1))
+        weights = equilibrium[active, None] + gaps
+
+        below = weights <= goal
+        hit = below.any(axis=1)
+        crossing = below.argmax(axis=1)
+        # Interpolate the day within the crossing week
+        rows = np.arange(len(active))
+        before = np.where(crossing > 0, weights[rows, crossing - 1], last_weight[active])
+        after = weights[rows, crossing]
+        fraction = np.clip((before - goal) / np.maximum(before - after, 1e-9), 0.0, 1.0)
+        weeks[active[hit]] = first_week + crossing[hit] + fraction[hit]
+
+        gap[active] = gaps[:, -1]
+        last_weight[active] = weights[:, -1]
+        active = active[~hit]
+
+    reached = np.isfinite(weeks)
+    days = weeks * 7.0
+
+    ordered = np.sort(days)
+    def percentile(q):
+        value = ordered[int(q * (n_sims - 1))]
+        return today + timedelta(days=int(np.ceil(value))) if np.isfinite(value) else None
+
+    return {
+        "p10": percentile(0.10),
+        "p50": percentile(0.50),
+        "p90": percentile(0.90),
+        "reach_probability": float(reached.mean()),
+        "weekly_loss": max(0.0, float(model["tdee"] - intake) * 7 / KCAL_PER_KG),
+    }
+
+def predict_progress(bundle, config, model=None):
+    """
+    Predicts weight loss progress from the fitted model.
+    bundle: DataBundle (see data_bundle.build_bundle)
+    Returns (expected weekly loss kg, projection, real 7-day deficit vs goal);
+    projection is simulate()'s dict (p10/p50/p90 goal dates, reach_probability).
+    """
+    goal_calories = _num(config.get('calorias_objetivo'), settings.DEFAULT_CALORIE_GOAL)
+    real_deficit = _num(config.get('deficit_calorico'), 500)
+
+    last_7_days = bundle.daily_nutrition.loc[bundle.today - timedelta(days=6):]
+    if not last_7_days.empty:
+        real_deficit = goal_calories - float(last_7_days['calories'].mean())
+    real_deficit = max(real_deficit, 0)
+
+    model = model or fit_model(bundle, config)
+    projection = simulate(model, today=bundle.today.date())
+    return round(projection["weekly_loss"], 2), projection, int(real_deficit)
@@ -1,55 +1,160 @@
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
-
-def check_dropout_risk(nutrition_df, body_df, adherence_score, config):
-    """
-    Detects dropout risk flags based on user behavior.
-    
-    Flags:
-    - 2 days no logging (consecutive)
-    - 2 days excess calories (consecutive)
-    - 7 days no weight change (plateau)
-    - Adherence < 70%
-    """
-    today = datetime.now().date()
-    yesterday = today - timedelta(days=1)
-    day_before = today - timedelta(days=2)
-    
-    daily_goal = config.get('calorias_objetivo', 2000)
-    
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Declarative dropout-risk rules, evaluated over the daily rollup.
+# Every rule has a name, a type, its parameters and a message template
+# (formatted with the rule's parameters plus the day's adherence).
+# Types:
+# - no_nutrition: nothing ever logged up to that day
+# - no_logging:   no meals on the `days` days before that day (needs some history)
+# - over_goal:    calories over goal on each of the `days` days before that day
+# - plateau:      >= 2 weigh-ins in the last `days` days, all within `grams`
+# - adherence:    7-day adherence below `threshold`
+RULES = [
+    {"name": "no_nutrition", "type": "no_nutrition", "message": "⚠️ Sin registros de nutrición"},
+    {"name": "no_logging", "type": "no_logging", "days": 2, "message": "⚠️ {days} días sin registrar comida"},
+    {"name": "over_goal", "type": "over_goal", "days": 2, "message": "⚠️ Calorías excedidas {days} días seguidos"},
+    {"name": "plateau", "type": "plateau", "days": 7, "grams": 200, "message": "⚠️ Peso estancado ({days} días sin cambio)"},
+    {"name": "low_adherence", "type": "adherence", "threshold": 70, "message": "⚠️ Adherencia crítica ({adherence}%)"},
+]
+
+def _lookback(rules):
+    """
+    How many days before the first evaluated day the rules need to see.
+    """
+    return max([rule.get("days", 0) for rule in rules] + [0])
+
+def _day_numbers(index):
+    return index.values.astype('datetime64[D]').astype(np.int64)
+
+def _align(index, values, first_day, length, fill):
+    """
+    Places per-day values (index: sorted DatetimeIndex) on a dense day grid
+    starting at first_day. Only the slice of index inside the grid is touched.
+    """
+    out = np.full(length, fill, dtype=values.dtype)
+    days = _day_numbers(index)
+    lo, hi = np.searchsorted(days, [first_day, first_day + length])
+    out[days[lo:hi] - first_day] = values[lo:hi]
+    return out
+
+def _signals(bundle, config, first_day, length):
+    """
+    Dense per-day arrays (first_day .. first_day + length - 1) every rule reads.
+    """
+    nutrition = bundle.daily_nutrition
+    calories = _align(nutrition.index, nutrition['calories'].to_numpy('float64'), first_day, length, np.nan)
+    logged = ~np.isnan(calories)
+    logged_before = int(np.searchsorted(_day_numbers(nutrition.index), first_day))
+
+    weight_max = np.full(length, -np.inf)
+    weight_min = np.full(length, np.inf)
+    weigh_ins = np.zeros(length, dtype=np.int64)
+    if not bundle.body.empty and 'weight' in bundle.body.columns:
+        days = _day_numbers(bundle.body.index)
+        lo, hi = np.searchsorted(days, [first_day, first_day + length])
+        weights = bundle.body['weight'].to_numpy('float64')[lo:hi]
+        slots = days[lo:hi] - first_day
+        measured = ~np.isnan(weights)
+        np.maximum.at(weight_max, slots[measured], weights[measured])
+        np.minimum.at(weight_min, slots[measured], weights[measured])
+        np.add.at(weigh_ins, slots[measured], 1)
+
+    return {
+        "calories": calories,
+        "logged": logged,
+        "ever_logged": np.cumsum(logged) + logged_before > 0,
+        "weight_max": weight_max,
+        "weight_min": weight_min,
+        "weigh_ins": weigh_ins,
+        "goal": config.get('calorias_objetivo', 2000),
+    }
+
+def _window_sum(values, window):
+    """
+    result[k] = values[k:k + window].sum()
+    """
+    totals = np.concatenate([[0], np.cumsum(values)])
+    return totals[window:] - totals[:-window]
+
+def _evaluate(rule, signals, adherence, offset, count):
+    """
+    Boolean array for the `count` days starting at grid position `offset`.
+    """
+    kind = rule["type"]
+    days = rule.get("days", 0)
+    if kind == "no_nutrition":
+        return ~signals["ever_logged"][offset:offset + count]
+    if kind == "no_logging":
+        # Window = the `days` days before each evaluated day (today excluded)
+        empty = _window_sum(signals["logged"], days)[offset - days:offset - days + count] == 0
+        return empty & signals["ever_logged"][offset:offset + count]
+    if kind == "over_goal":
+        over = signals["calories"] > signals["goal"]
+        return _window_sum(over, days)[offset - days:offset - days + count] == days
+    if kind == "plateau":
+        # Window = today and the `days` days before it
+        window = days + 1
+        highest = sliding_window_view(signals["weight_max"], window).max(axis=1)[offset - days:offset - days + count]
+        lowest = sliding_window_view(signals["weight_min"], window).min(axis=1)[offset - days:offset - days + count]
+        weigh_ins = _window_sum(signals["weigh_ins"], window)[offset - days:offset - days + count]
+        return (weigh_ins >= 2) & (highest - lowest < rule["grams"] / 1000.0)
+    if kind == "adherence":
+        if adherence is None:
+            return np.zeros(count, dtype=bool)
+        return np.asarray(adherence, dtype='float64') < rule["threshold"]
+    raise ValueError(f"Unknown risk rule type: {kind}")
+
+def evaluate_rules(bundle, config, start, end, adherence=None, rules=None):
+    """
+    Evaluates every rule for every day in [start, end] in one vectorized pass.
+    adherence: 7-day adherence per day (array-like, same length), optional.
+    Returns a boolean DataFrame indexed by day, one column per rule name.
+    """
+    rules = RULES if rules is None else rules
+    start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+    count = (end - start).days + 1
+    lookback = _lookback(rules)
+    first_day = int(np.datetime64(start.date(), 'D').astype(np.int64)) - lookback
+    signals = _signals(bundle, config, first_day, lookback + count)
+    flags = {rule["name"]: _evaluate(rule, signals, adherence, lookback, count) for rule in rules}
+    return pd.DataFrame(flags, index=pd.date_range(start, periods=count, name='date'))
+
+def check_dropout_risk(bundle, adherence_score, config, rules=None):
+    """
+    Detects dropout risk flags for today based on user behavior.
+    bundle: DataBundle (see data_bundle.build_bundle)
+    Returns the messages of the rules that fire (see RULES).
+    """
+    rules = RULES if rules is None else rules
+    lookback = _lookback(rules)
+    first_day = int(np.datetime64(bundle.today.date(), 'D').astype(np.int64)) - lookback
+    signals = _signals(bundle, config, first_day, lookback + 1)
+
     risk_flags = []
-    
-    # Check logging
-    if not nutrition_df.empty:
-        nutrition_df['date'] = pd.to_datetime(nutrition_df['date'], errors='coerce').dt.date
-        last_2_days = nutrition_df[nutrition_df['date'].isin([yesterday, day_before])]
-        if last_2_days.empty: # No logs in last 2 days
-            risk_flags.append("⚠️ 2 días sin registrar comida")
-            
-        # Check excess calories
-        excess_count = 0
-        for day in [yesterday, day_before]:
-            day_logs = nutrition_df[nutrition_df['date'] == day]
-            if not day_logs.empty and day_logs['calories'].sum() > daily_goal:
-                excess_count += 1
-        
-        if excess_count >= 2:
-            risk_flags.append("⚠️ Calorías excedidas 2 días seguidos")
-            
-    else:
-        risk_flags.append("⚠️ Sin registros de nutrición")
-
-    # Check weight plateau
-    if not body_df.empty:
-        body_df['date'] = pd.to_datetime(body_df['date'], errors='coerce').dt.date
-        last_7_days = body_df[body_df['date'] >= (today - timedelta(days=7))]
-        if not last_7_days.empty and len(last_7_days) >= 2:
-            weights = last_7_days['weight'].values
-            if max(weights) - min(weights) < 0.2: # Less than 200g variation
-                risk_flags.append("⚠️ Peso estancado (7 días sin cambio)")
-                
-    # Check adherence
-    if adherence_score < 70:
-        risk_flags.append(f"⚠️ Adherencia crítica ({int(adherence_score)}%)")
-        
+    for rule in rules:
+        if _evaluate(rule, signals, [adherence_score], lookback, 1)[0]:
+            risk_flags.append(rule["message"].format(adherence=int(adherence_score), **rule))
     return risk_flags
+
+def backtest(bundle, config, adherence=None, rules=None):
+    """
+    Replays the rules over the whole history (first log .. today).
+    adherence: rolling 7-day adherence indexed by day (adherence_engine.rolling_adherence()['adherence']).
+    Returns (flags, summary): the per-day boolean frame and, per rule,
+    how many days it fired and on which share of days.
+    """
+    rules = RULES if rules is None else rules
+    starts = [idx.min() for idx in (bundle.daily.index, bundle.body.index) if len(idx)]
+    start = min(starts + [bundle.today])
+    days = pd.date_range(start, bundle.today, name='date')
+    if adherence is not None:
+        adherence = adherence.reindex(days).fillna(0).to_numpy()
+
+    flags = evaluate_rules(bundle, config, start, bundle.today, adherence, rules)
+    summary = pd.DataFrame({
+        "days_fired": flags.sum(),
+        "rate": flags.mean() * 100,
+    })
+    return flags, summary
@@ -2,11 +2,10 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import streamlit as st
-import pandas as pd
-from datetime import datetime
-from app.services import google_sheets_service as sheets
+from app.services import storage_service as storage
 from app.config import settings
-from app.engines import config_manager, phase_engine, adherence_engine, risk_engine, projection_engine, ai_feedback_engine
+from app.components import charts
+from app.engines import config_manager, projection_engine, ai_feedback_engine, data_bundle, pipeline
 
 st.set_page_config(
     page_title="Health Tracker Élite",
@@ -15,58 +14,51 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+def render_coach_message(box, message, risk_flags, adherence_level):
+    if risk_flags:
+        box.error(f"⚠️ **ATENCIÓN:** {message}")
+    elif adherence_level == "ÉLITE":
+        box.success(f"🏆 **COACH:** {message}")
+    else:
+        box.info(f"💡 **COACH:** {message}")
+
 def main():
-    # Initialize sheets if needed (lazy init)
-    if 'sheets_initialized' not in st.session_state:
-        sheets.init_sheets()
-        st.session_state['sheets_initialized'] = True
+    # Initialize storage if needed (runs once per process)
+    storage.init_sheets()
+
+    # 1. Load Data (Cached, one batched read incl. profile; nutrition, water and
+    # habits come pre-aggregated per day from the rollup)
+    with st.spinner("Analizando datos fisiológicos..."):
+        data = storage.load_many([
+            settings.SHEET_BODY_METRICS,
+            settings.SHEET_MEDICATION_LOG,
+            settings.SHEET_PROFILE
+        ])
+        body_df = data[settings.SHEET_BODY_METRICS]
+        meds_df = data[settings.SHEET_MEDICATION_LOG]
+        daily_df = storage.load_daily()
 
-    # 1. Load Config (User Profile + Targets)
+    # 2. Load Config (User Profile + Targets, served from the cache above)
     config = config_manager.load_config()
     
     st.title(f"🧬 Dashboard Élite: {config.get('name', 'Atleta')}")
     
-    today = datetime.now().date()
-    
-    # 2. Load Data (Cached)
-    with st.spinner("Analizando datos fisiológicos..."):
-        body_df = sheets.load_data(settings.SHEET_BODY_METRICS)
-        nutrition_df = sheets.load_data(settings.SHEET_NUTRITION_LOG)
-        water_df = sheets.load_data(settings.SHEET_WATER_LOG)
-        meds_df = sheets.load_data(settings.SHEET_MEDICATION_LOG)
-        habits_df = sheets.load_data(settings.SHEET_HABITS_LOG)
+    # Shared, preprocessed view of the data for every engine (built once per render)
+    bundle = data_bundle.build_bundle(body_df, meds_df, daily_df)
+    today = bundle.today
         
-    # 3. Process Logic Engines
-    
-    # A. Phase Engine
-    phase_name, phase_desc = phase_engine.determine_phase(config.get('start_date'))
-    
-    # B. Adherence Engine
-    adherence_score, adherence_level, adherence_details = adherence_engine.calculate_weekly_adherence(nutrition_df, habits_df, config)
-    
-    # C. Risk Engine
-    risk_flags = risk_engine.check_dropout_risk(nutrition_df, body_df, adherence_score, config)
-    
-    # D. Projection Engine
-    weekly_loss, target_date, real_deficit = projection_engine.predict_progress(nutrition_df, config)
-    
-    # E. AI Feedback Engine (Gemini)
-    weight_change = 0
-    if not body_df.empty:
-        # Calculate recent change (last 7 days or total?)
-        # Let's say last vs first of last 7 days or just total logic inside prompt
-        # Passing simple scalar to AI for now
-        current_w = config.get('current_weight', 0)
-        start_w = config.get('peso_inicial', 0)
-        weight_change = round(current_w - start_w, 1)
-
-    ai_message = ai_feedback_engine.generate_coach_feedback(
-        phase_name, 
-        adherence_level, 
-        weight_change, 
-        risk_flags, 
-        config.get('name', 'Atleta')
-    )
+    # 3. Process Logic Engines (phase, adherence, risk, projection, AI coach).
+    # The pipeline only recomputes engines whose inputs changed since the last rerun.
+    results = pipeline.run(bundle, config)
+    phase_name, phase_desc = results["phase"]
+    adherence_windows = results["adherence"]
+    adherence_score, adherence_level, adherence_details = adherence_windows[7]
+    adherence_trend = results["adherence_trend"]
+    risk_flags = results["risk"]
+    _, risk_summary = results["risk_history"]
+    projection_model, (weekly_loss, projection, real_deficit) = results["projection"]
+    # The AI message is generated in the background and streamed in at the end
+    coach = ai_feedback_engine.request_coach_feedback(**results["coach"])
 
     # --- DASHBOARD LAYOUT ---
     
@@ -75,45 +67,38 @@ def main():
     with c1:
         st.info(f"**FASE ACTUAL:** {phase_name}\n\n_{phase_desc}_")
     with c2:
-        if risk_flags:
-            st.error(f"⚠️ **ATENCIÓN:** {ai_message}")
-        elif adherence_level == "ÉLITE":
-            st.success(f"🏆 **COACH:** {ai_message}")
+        coach_box = st.empty()
+        coach_pending = not coach.done
+        if coach_pending:
+            coach_box.info("💡 **COACH:** _Analizando tu semana..._")
         else:
-            st.info(f"💡 **COACH:** {ai_message}")
+            render_coach_message(coach_box, coach.text, risk_flags, adherence_level)
             
     # Risk Flags Banner
     if risk_flags:
         for flag in risk_flags:
             st.warning(flag)
 
+    # How often each alert would have fired over the whole history
+    with st.expander("📊 Historial de alertas"):
+        st.dataframe(
+            risk_summary.rename(columns={"days_fired": "Días activa", "rate": "% de días"}).round(1),
+            use_container_width=True
+        )
+
     st.markdown("---")
     
     # Section: TODAY'S METRICS
     st.subheader("📅 Hoy")
     
-    # Calculate Today's numbers
-    today_calories = 0
-    if not nutrition_df.empty:
-        nutrition_df['date'] = pd.to_datetime(nutrition_df['date'], errors='coerce').dt.date
-        today_nutrition = nutrition_df[nutrition_df['date'] == today]
-        today_calories = today_nutrition['calories'].sum()
+    # Calculate Today's numbers (from the bundle's daily aggregates)
+    today_calories = bundle.daily_nutrition['calories'].get(today, 0)
         
     daily_goal = config.get('calorias_objetivo', 2000)
     remaining = daily_goal - today_calories
     
-    # Habits Today
-    today_elite_habits = 0
-    if not habits_df.empty:
-        habits_df['date'] = pd.to_datetime(habits_df['date'], errors='coerce').dt.date
-        today_habits = habits_df[habits_df['date'] == today]
-        if not today_habits.empty:
-            today_habits = today_habits.drop_duplicates(subset=['habit_name'], keep='last')
-            # Count elite habits
-            for h in settings.ELITE_HABITS:
-                 if not today_habits[today_habits['habit_name'] == h].empty:
-                     if today_habits[today_habits['habit_name'] == h].iloc[0]['status'] == "Completado":
-                         today_elite_habits += 1
+    # Habits Today (last status logged for each elite habit)
+    today_elite_habits = int(bundle.daily_habits['elite_completed'].get(today, 0))
 
     k1, k2, k3, k4 = st.columns(4)
     k1.metric("Calorías Restantes", f"{int(remaining)}", f"Meta: {daily_goal}")
@@ -131,15 +116,35 @@ def main():
     with p1:
         st.write("#### Ritmo Actual")
         st.write(f"Perdiendo **{weekly_loss} kg/semana**")
-        st.caption("Basado en tu déficit real de la última semana.")
+        st.caption("Basado en tu ingesta habitual y tu gasto estimado (TDEE).")
         
     with p2:
         st.write("#### Meta Estimada")
-        if target_date:
-            st.write(f"Llegada: **{target_date}**")
+        if projection['p50']:
+            st.write(f"Llegada: **{projection['p50']}**")
+        elif projection['reach_probability'] > 0:
+            # Less than even odds within the horizon: no median date to show
+            st.write(f"Probabilidad de llegar en 3 años: **{int(projection['reach_probability'] * 100)}%**")
+            if projection['p10']:
+                st.caption(f"Escenario optimista (P10): {projection['p10']}")
         else:
-            st.write("Datos insuficientes o sin déficit.")
+            st.write("Al ritmo actual no alcanzarías la meta en 3 años.")
         st.caption(f"Peso Meta: {config.get('peso_meta')} kg")
+        with st.expander("🔮 ¿Y si...?"):
+            what_if_intake = st.slider(
+                "Calorías diarias",
+                min_value=1000, max_value=4000, step=50,
+                value=min(max(int(round(projection_model['intake'] / 50) * 50), 1000), 4000)
+            )
+            what_if = projection_engine.simulate(projection_model, intake=what_if_intake, today=today.date())
+            if what_if['p50']:
+                st.write(f"Llegada probable: **{what_if['p50']}**")
+                st.caption(
+                    f"Optimista (P10): {what_if['p10'] or '—'} · Pesimista (P90): {what_if['p90'] or '—'} · "
+                    f"Probabilidad en 3 años: {int(what_if['reach_probability'] * 100)}%"
+                )
+            else:
+                st.write("Con esa ingesta no alcanzarías la meta en 3 años.")
 
     with p3:
         st.write("#### Detalles de Adherencia")
@@ -150,6 +155,15 @@ def main():
             st.write(f"- Entrenamiento: {int(adherence_details['workout'])}%")
             st.write(f"- Registro Comidas: {int(adherence_details['logging'])}%")
             st.write(f"- Hábitos Élite: {int(adherence_details['elite'])}%")
+            st.caption(
+                f"Adherencia 30 días: {int(adherence_windows[30][0])}% · "
+                f"90 días: {int(adherence_windows[90][0])}%"
+            )
+
+    # Adherence trend (rolling 7-day window over the whole history)
+    trend_fig = charts.plot_adherence_trend(adherence_trend)
+    if trend_fig:
+        st.plotly_chart(trend_fig, use_container_width=True)
 
     # Quick Actions (Bottom)
     st.divider()
@@ -161,5 +175,11 @@ def main():
     if c3.button("⚖️ Actualizar Peso", use_container_width=True):
         st.switch_page("pages/1_Progreso_Corporal.py")
 
+    # Everything else is already on screen: now stream the coach message in
+    if coach_pending:
+        with coach_box.container():
+            st.write_stream(coach.stream())
+        render_coach_message(coach_box, coach.text or coach.fallback, risk_flags, adherence_level)
+
 if __name__ == "__main__":
     main()
@@ -3,7 +3,7 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 import streamlit as st
 from datetime import datetime
-from app.services import google_sheets_service as sheets
+from app.services import storage_service as storage
 from app.services import analytics_service as analytics
 from app.config import settings
 from app.components import charts
@@ -46,14 +46,14 @@ with tab1:
                 "thighs": thighs,
                 "notes": notes
             }
-            if sheets.add_row(settings.SHEET_BODY_METRICS, row):
+            if storage.add_row(settings.SHEET_BODY_METRICS, row):
                 st.success("Registro guardado exitosamente!")
             else:
                 st.error("Error al guardar el registro.")
 
 with tab2:
     st.header("Historial y Análisis")
-    df = sheets.load_data(settings.SHEET_BODY_METRICS)
+    df = storage.load_data(settings.SHEET_BODY_METRICS)
     
     if not df.empty:
         # Metrics
@@ -3,22 +3,21 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 import streamlit as st
 from datetime import datetime
-from app.services import google_sheets_service as sheets
-from app.services import gemini_service
+from app.services import storage_service as storage
+from app.services import food_scanner
+from app.services import vision_service
+from app.services import image_service
 from app.config import settings
 from app.components import charts
 import pandas as pd
-from PIL import Image
 
 st.set_page_config(page_title="Nutrición IA", page_icon="🍎")
 
-# Ensure sheets are initialized
-if 'sheets_initialized' not in st.session_state:
-    try:
-        sheets.init_sheets()
-        st.session_state['sheets_initialized'] = True
-    except Exception as e:
-        st.error(f"Error conectando a la base de datos: {e}")
+# Ensure storage is initialized (runs once per process)
+try:
+    storage.init_sheets()
+except Exception as e:
+    st.error(f"Error conectando a la base de datos: {e}")
 
 st.title("🍎 Nutrición Inteligente (Gemini AI)")
 
@@ -39,16 +38,42 @@ with tab1:
     file_to_process = img_file if img_file else camera_file
     
     if file_to_process:
-        image = Image.open(file_to_process)
+        # Keep only the compact version of the photo in the session, and
+        # process each upload once instead of on every rerun
+        if st.session_state.get('photo_id') != file_to_process.file_id:
+            st.session_state['photo'] = image_service.preprocess_image(file_to_process)
+            st.session_state['photo_id'] = file_to_process.file_id
+        image = st.session_state['photo']
         st.image(image, caption="Tu Foto", use_container_width=True)
         
         # User context input
         user_context = st.text_input("Contexto adicional (opcional)", placeholder="Ej: Es frito, cocinado con aceite de oliva, sin piel...")
         
+        # A photo the local filter rejected can still be sent to Gemini
+        force_gemini = False
+        rejected = st.session_state.get('rejected_photo')
+        if rejected and rejected[0] == st.session_state['photo_id']:
+            st.warning(rejected[1])
+            force_gemini = st.checkbox("Analizar igualmente con Gemini")
+
         if st.button("✨ Analizar Calorías con IA"):
+            detected_items = []
+            scan = food_scanner.scan(image, user_context, use_prefilter=not force_gemini)
+            if scan["decision"] == vision_service.REJECT:
+                st.session_state['rejected_photo'] = (st.session_state['photo_id'], scan["reason"])
+                st.rerun()
+            # Each food shows up as soon as the model finishes describing it
+            preview = st.empty()
             with st.spinner("La IA está analizando tu plato..."):
-                detected_items, _ = gemini_service.analyze_image_with_gemini(image, user_context)
-                
+                for item in scan["items"]:
+                    detected_items.append(item)
+                    with preview.container():
+                        for found in detected_items:
+                            st.write(f"🍽️ **{found['name']}** · {found['estimated_grams']} g · {found['calories']} kcal")
+            preview.empty()
+            if scan["decision"] == vision_service.LOCAL:
+                st.caption(f"⚡ Reconocido localmente en {scan['elapsed_ms']:.0f} ms, sin usar Gemini.")
+
             if detected_items:
                 st.success(f"¡He encontrado {len(detected_items)} ingredientes!")
                 st.session_state['detected_items'] = detected_items # Persist for form interaction
@@ -110,7 +135,7 @@ with tab1:
                         "fats": round(total_fat, 1),
                         "notes": f"[IA] {notes}"
                     }
-                    if sheets.add_row(settings.SHEET_NUTRITION_LOG, row):
+                    if storage.add_row(settings.SHEET_NUTRITION_LOG, row):
                         st.success("¡Guardado en Google Sheets correctamente!")
                         st.balloons()
                         # Clear session state to reset
@@ -140,7 +165,7 @@ with tab2:
                 "fats": fats,
                 "notes": notes
             }
-            if sheets.add_row(settings.SHEET_NUTRITION_LOG, row):
+            if storage.add_row(settings.SHEET_NUTRITION_LOG, row):
                 st.success("¡Comida registrada en la base de datos!")
             else:
                 st.error("Error al registrar en Google Sheets.")
@@ -149,25 +174,25 @@ st.divider()
     
 # Daily Summary
 st.subheader("Resumen de Hoy")
-df = sheets.load_data(settings.SHEET_NUTRITION_LOG)
-if not df.empty:
-    today = datetime.now().date()
-    # Safe date conversion
-    df['date'] = pd.to_datetime(df['date'], errors='coerce').dt.date
-    today_df = df[df['date'] == today]
+daily = storage.load_daily()
+if not daily.empty:
+    # Per-day totals come from the daily rollup, no need to scan every meal
+    today = pd.Timestamp(datetime.now().date())
+    logged = daily[daily['meals'] > 0]
     
-    if not today_df.empty:
-        total_cal = today_df['calories'].sum()
-        total_pro = today_df['protein'].sum()
-        total_carb = today_df['carbs'].sum()
-        total_fat = today_df['fats'].sum()
+    if today in logged.index:
+        totals = logged.loc[today]
+        total_cal = totals['calories']
+        total_pro = totals['protein']
+        total_carb = totals['carbs']
+        total_fat = totals['fats']
         
         # Get goals from session or settings
         cal_goal = st.session_state.get('user_profile', {}).get('daily_calories', settings.DEFAULT_CALORIE_GOAL)
         
         c1, c2, c3, c4 = st.columns(4)
         remaining = cal_goal - total_cal
-        c1.metric("Calorías", total_cal, f"{remaining} restantes", delta_color="normal" if remaining > 0 else "inverse")
+        c1.metric("Calorías", int(total_cal), f"{int(remaining)} restantes", delta_color="normal" if remaining > 0 else "inverse")
         c2.metric("Proteína", f"{int(total_pro)}g")
         c3.metric("Carbs", f"{int(total_carb)}g")
         c4.metric("Grasas", f"{int(total_fat)}g")
@@ -177,7 +202,7 @@ if not df.empty:
             
         # Daily History Chart
         st.subheader("Historial Diario")
-        daily_summary = df.groupby('date')['calories'].sum().reset_index()
+        daily_summary = logged['calories'].reset_index()
         fig = charts.plot_calories_trend(daily_summary, cal_goal)
         st.plotly_chart(fig, use_container_width=True)
         
@@ -4,7 +4,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-from app.services import google_sheets_service as sheets
+from app.services import storage_service as storage
 from app.config import settings
 
 st.set_page_config(page_title="Hidratación", page_icon="💧")
@@ -12,27 +12,18 @@ st.set_page_config(page_title="Hidratación", page_icon="💧")
 st.title("💧 Hidratación")
 
 # Get today's date
-today = datetime.now().date()
+today = pd.Timestamp(datetime.now().date())
 
 # Load data
-df = sheets.load_data(settings.SHEET_WATER_LOG)
+df = storage.load_data(settings.SHEET_WATER_LOG)
 
 current_water = 0
 goal = settings.DEFAULT_WATER_GOAL
 
-if not df.empty:
-    # Ensure date column is datetime object for accurate comparison
-    # Coerce errors to NaT to handle potential bad data, then drop them or ignore
-    df['date'] = pd.to_datetime(df['date'], errors='coerce').dt.date
-    
-    # Filter for today's records
-    today_df = df[df['date'] == today]
-    
-    if not today_df.empty:
-        # Sum the amount_ml column
-        # Ensure amount_ml is numeric
-        today_df['amount_ml'] = pd.to_numeric(today_df['amount_ml'], errors='coerce').fillna(0)
-        current_water = today_df['amount_ml'].sum()
+# Today's total from the daily rollup
+today_totals = storage.load_daily(today, today)
+if not today_totals.empty:
+    current_water = today_totals['water_ml'].iloc[0]
 
 # Calculate progress
 # Avoid division by zero
@@ -57,11 +48,11 @@ st.subheader("Registrar Agua")
 
 def log_water(amount):
     row = {
-        "date": str(today),
+        "date": today.strftime(settings.DATE_FORMAT),
         "amount_ml": amount,
         "goal_ml": goal
     }
-    if sheets.add_row(settings.SHEET_WATER_LOG, row):
+    if storage.add_row(settings.SHEET_WATER_LOG, row):
         st.toast(f"Añadido {amount}ml")
         st.rerun()
 
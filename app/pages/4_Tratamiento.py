@@ -5,7 +5,7 @@ import streamlit as st
 from datetime import datetime
 import pandas as pd
 import plotly.express as px
-from app.services import google_sheets_service as sheets
+from app.services import storage_service as storage
 from app.config import settings
 
 st.set_page_config(page_title="Tratamiento", page_icon="💊")
@@ -52,14 +52,14 @@ with tab1:
                 "adherence": adherence,
                 "notes": ""
             }
-            if sheets.add_row(settings.SHEET_MEDICATION_LOG, row):
+            if storage.add_row(settings.SHEET_MEDICATION_LOG, row):
                 st.success("Registro guardado exitosamente!")
             else:
                 st.error("Error al guardar el registro.")
 
 with tab2:
     st.header("Monitoreo de Efectos")
-    df = sheets.load_data(settings.SHEET_MEDICATION_LOG)
+    df = storage.load_data(settings.SHEET_MEDICATION_LOG)
     
     if not df.empty:
         # Appetite vs Time
@@ -4,7 +4,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-from app.services import google_sheets_service as sheets
+from app.services import storage_service as storage
 from app.config import settings
 
 st.set_page_config(page_title="Hábitos Élite", page_icon="🔥")
@@ -14,15 +14,15 @@ st.title("🔥 Sistema de Hábitos: MODO ÉLITE")
 # Date Selector
 selected_date = st.date_input("Fecha", datetime.now())
 selected_date_str = str(selected_date)
+selected_ts = pd.Timestamp(selected_date)
 
 # Load existing data for this date
 existing_data = {}
-df = sheets.load_data(settings.SHEET_HABITS_LOG)
+df = storage.load_data(settings.SHEET_HABITS_LOG)
 
 if not df.empty:
-    # Ensure date column is string for comparison
-    df['date'] = df['date'].astype(str)
-    day_records = df[df['date'] == selected_date_str]
+    # Dates are already parsed to datetime64 by the loader
+    day_records = df[df['date'] == selected_ts]
     
     for index, row in day_records.iterrows():
         habit_name = row['habit_name']
@@ -59,7 +59,7 @@ with st.form("habits_form"):
     notes_val = ""
     # Try to find existing notes (usually attached to first habit or any)
     if not df.empty:
-        day_records = df[df['date'] == selected_date_str]
+        day_records = df[df['date'] == selected_ts]
         if not day_records.empty:
             # Get first non-empty note
             possible_notes = day_records[day_records['notes'] != ""]['notes'].values
@@ -71,22 +71,21 @@ with st.form("habits_form"):
     submitted = st.form_submit_button("Guardar Puntuación")
     
     if submitted:
-        success_count = 0
+        rows = []
         for habit, status in status_dict.items():
-            row = {
+            rows.append({
                 "date": selected_date_str,
                 "habit_name": habit,
                 "status": "Completado" if status else "Pendiente",
                 "notes": notes if habit == settings.ELITE_HABITS[0] else "" 
-            }
-            if sheets.add_row(settings.SHEET_HABITS_LOG, row):
-                success_count += 1
+            })
         
-        if success_count == len(settings.ELITE_HABITS):
+        # One request for the whole checklist
+        if storage.add_rows(settings.SHEET_HABITS_LOG, rows):
             st.success("¡Progreso registrado!")
             st.rerun()
         else:
-            st.warning(f"Se guardaron {success_count} de {len(settings.ELITE_HABITS)} hábitos.")
+            st.warning("No se pudieron guardar los hábitos. Intenta de nuevo.")
 
 st.divider()
 
@@ -95,7 +94,7 @@ st.header("📊 Historial de Puntuación")
 if not df.empty:
     # Process data to show daily scores
     # Group by date
-    df['status_bool'] = df['status'].apply(lambda x: 1 if x == "Completado" else 0)
+    df['status_bool'] = (df['status'] == "Completado").astype(int)
     
     # Filter only Elite habits if mixed with old ones
     df_elite = df[df['habit_name'].isin(settings.ELITE_HABITS)]
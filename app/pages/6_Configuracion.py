@@ -4,19 +4,22 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
-from app.services import google_sheets_service as sheets
+from app.services import storage_service as storage
 from app.services import profile_service
+from app.services import write_journal
+from app.services import sheets_quota
+from app.services import model_registry
+from app.services import image_cache
+from app.engines import pipeline
 from app.config import settings
 
 st.set_page_config(page_title="Configuración", page_icon="⚙️")
 
-# Ensure sheets are initialized
-if 'sheets_initialized' not in st.session_state:
-    try:
-        sheets.init_sheets()
-        st.session_state['sheets_initialized'] = True
-    except Exception as e:
-        st.error(f"Error conectando a la base de datos: {e}")
+# Ensure storage is initialized (runs once per process)
+try:
+    storage.init_sheets()
+except Exception as e:
+    st.error(f"Error conectando a la base de datos: {e}")
 
 st.title("⚙️ Configuración y Perfil")
 
@@ -103,14 +106,62 @@ tab1, tab2 = st.tabs(["Base de Datos", "Logs"])
 with tab1:
     # Use st.secrets if available, otherwise fallback to generic message
     sheet_name = st.secrets.get("spreadsheet", {}).get("name", "No Configurado")
+    st.write(f"Almacenamiento principal: `{settings.STORAGE_BACKEND}`")
+    if settings.STORAGE_BACKEND != "sheets":
+        st.write(f"Base de datos local: `{settings.LOCAL_DB_PATH}`")
+        if not settings.DATA_DIR_PERSISTENT:
+            st.warning(
+                "La base local no está marcada como almacenamiento persistente "
+                "(HEALTH_TRACKER_DATA_PERSISTENT=1). En Cloud Run cada instancia tendría sus "
+                "propios datos y se perderían al reiniciarse."
+            )
+        st.write(f"Espejo en Google Sheets: {'Activo' if storage.mirror_enabled() else 'Inactivo'}")
     st.write(f"Hoja de Cálculo Conectada: `{sheet_name}`")
+    journal_stats = write_journal.stats()
+    st.caption(
+        f"Escrituras pendientes hacia Google Sheets: {journal_stats['pending']} "
+        f"(con errores: {journal_stats['failing']})"
+    )
+    quota_stats = sheets_quota.stats()
+    st.caption(
+        f"Cuota Sheets: {quota_stats['calls']} llamadas, {quota_stats['throttled']} limitadas (429), "
+        f"{quota_stats['wait_s']}s de espera"
+    )
     if st.button("Probar Conexión (Reiniciar Sheets)"):
         try:
-            sheets.init_sheets()
+            storage.reset_connection()
+            storage.init_sheets(force=True)
             st.success("Conexión exitosa con Google Sheets")
             st.balloons()
         except Exception as e:
             st.error(f"Error: {e}")
 
 with tab2:
-    st.info("Logs del sistema (Próximamente)")
+    engine_stats = pipeline.stats()
+    if engine_stats:
+        st.write("Motores del dashboard (resultados en caché mientras sus datos no cambien)")
+        st.dataframe(
+            pd.DataFrame.from_dict(engine_stats, orient="index")[["hits", "misses", "last_ms", "avg_ms"]]
+            .rename(columns={"hits": "Aciertos", "misses": "Recalculados", "last_ms": "Último (ms)", "avg_ms": "Promedio (ms)"})
+            .round(2),
+            use_container_width=True
+        )
+    else:
+        st.info("Abre el Dashboard para ver las estadísticas de los motores.")
+
+    model_health = model_registry.snapshot()
+    if model_health:
+        st.write("Modelos de Gemini (los que fallan se omiten hasta su reintento)")
+        st.dataframe(
+            pd.DataFrame.from_dict(model_health, orient="index")
+            .rename(columns={"state": "Estado", "failures": "Fallos", "successes": "Éxitos", "retry_in_s": "Reintento (s)", "last_error": "Último error"}),
+            use_container_width=True
+        )
+
+    photo_cache = image_cache.stats()
+    if photo_cache["entries"]:
+        st.caption(
+            f"Caché de fotos analizadas: {photo_cache['entries']} entradas, "
+            f"{photo_cache['hits']} aciertos, "
+            f"{photo_cache['misses']} análisis nuevos"
+        )
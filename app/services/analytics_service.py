@@ -36,23 +36,6 @@ def calculate_tmb(weight_kg, height_cm, age, gender, activity_level="sedentary")
     
     return round(bmr * multipliers.get(activity_level, 1.2))
 
-def project_weight_loss(current_weight, goal_weight, weekly_loss_kg):
-    """
-    Projects the date to reach the goal weight based on weekly loss rate.
-    """
-    if weekly_loss_kg <= 0:
-        return None # No loss or gain
-    
-    diff = current_weight - goal_weight
-    if diff <= 0:
-        return datetime.now().date()
-        
-    weeks_needed = diff / weekly_loss_kg
-    days_needed = weeks_needed * 7
-    
-    target_date = datetime.now() + timedelta(days=days_needed)
-    return target_date.date()
-
 def calculate_phase(start_date):
     """
     Calculates the current phase based on weeks since start.
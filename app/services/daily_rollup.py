@@ -0,0 +1,279 @@
+import json
+import threading
+import streamlit as st
+import pandas as pd
+from app.config import settings
+from app.services import local_store
+from app.services import schema
+
+# Materialized per-day totals, kept next to the local tables and updated
+# incrementally on every write, so readers pay O(days) instead of O(rows).
+# One row per day:
+#   calories, protein, carbs, fats, meals  <- nutrition_log
+#   water_ml, water_logs                   <- water_log
+#   elite_completed, workout               <- habits_log (last status per habit)
+
+NUTRITION_COLS = ["calories", "protein", "carbs", "fats"]
+COLUMNS = NUTRITION_COLS + ["meals", "water_ml", "water_logs", "elite_completed", "workout"]
+SOURCES = [settings.SHEET_NUTRITION_LOG, settings.SHEET_WATER_LOG, settings.SHEET_HABITS_LOG]
+
+# Decoded copy of the whole table, dropped on write. Callers always get a copy.
+_frame = None
+_frame_lock = threading.Lock()
+
+@st.cache_resource
+def init():
+    """
+    Creates the rollup tables. Runs once per process, before any write.
+    """
+    conn = local_store.get_connection()
+    with local_store.get_lock():
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS daily_rollup ("
+            "date TEXT PRIMARY KEY, "
+            "calories REAL NOT NULL DEFAULT 0, protein REAL NOT NULL DEFAULT 0, "
+            "carbs REAL NOT NULL DEFAULT 0, fats REAL NOT NULL DEFAULT 0, "
+            "meals INTEGER NOT NULL DEFAULT 0, "
+            "water_ml REAL NOT NULL DEFAULT 0, water_logs INTEGER NOT NULL DEFAULT 0, "
+            "elite_completed INTEGER NOT NULL DEFAULT 0, workout INTEGER NOT NULL DEFAULT 0)"
+        )
+        # Last status per (day, habit), needed to update habit counts incrementally
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS daily_habit_status ("
+            "date TEXT NOT NULL, habit_name TEXT NOT NULL, status TEXT NOT NULL, "
+            "PRIMARY KEY (date, habit_name))"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS rollup_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    return True
+
+def _drop_frame():
+    global _frame
+    with _frame_lock:
+        _frame = None
+
+def _typed_batch(worksheet_name, rows):
+    df = schema.coerce(worksheet_name, pd.DataFrame(rows))
+    if 'date' not in df.columns:
+        return pd.DataFrame()
+    df = df[df['date'].notna()]
+    return df.assign(day=df['date'].dt.strftime(settings.DATE_FORMAT))
+
+def _refresh_habit_days(conn, days):
+    placeholders = ", ".join("?" for _ in settings.ELITE_HABITS)
+    for day in days:
+        elite = conn.execute(
+            f"SELECT COUNT(*) FROM daily_habit_status WHERE date = ? AND status = 'Completado' "
+            f"AND habit_name IN ({placeholders})",
+            [day, *settings.ELITE_HABITS]
+        ).fetchone()[0]
+        # LIKE is case-insensitive for ASCII, same as the pandas check it replaces
+        workout = conn.execute(
+            "SELECT COUNT(*) > 0 FROM daily_habit_status WHERE date = ? AND status = 'Completado' "
+            "AND habit_name LIKE '%ENTRENAMIENTO%'",
+            (day,)
+        ).fetchone()[0]
+        conn.execute(
+            "INSERT INTO daily_rollup (date, elite_completed, workout) VALUES (?, ?, ?) "
+            "ON CONFLICT(date) DO UPDATE SET elite_completed = excluded.elite_completed, workout = excluded.workout",
+            (day, elite, workout)
+        )
+
+def apply_rows(conn, worksheet_name, rows):
+    """
+    Folds newly stored rows into the rollup. Runs on the caller's open
+    transaction (see local_store.insert_rows(on_insert=...)) so the log and
+    its totals commit together. Only touches the days present in rows.
+    """
+    if worksheet_name not in SOURCES or not rows:
+        return
+    batch = _typed_batch(worksheet_name, rows)
+    if batch.empty:
+        return
+
+    if worksheet_name == settings.SHEET_NUTRITION_LOG:
+        totals = batch.groupby('day')[NUTRITION_COLS].sum().astype('float64').fillna(0)
+        totals['meals'] = batch.groupby('day').size()
+        conn.executemany(
+            "INSERT INTO daily_rollup (date, calories, protein, carbs, fats, meals) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(date) DO UPDATE SET calories = calories + excluded.calories, "
+            "protein = protein + excluded.protein, carbs = carbs + excluded.carbs, "
+            "fats = fats + excluded.fats, meals = meals + excluded.meals",
+            [(day, *map(float, values)) for day, values in zip(totals.index, totals.itertuples(index=False))]
+        )
+    elif worksheet_name == settings.SHEET_WATER_LOG:
+        totals = batch.groupby('day')['amount_ml'].agg(['sum', 'size'])
+        conn.executemany(
+            "INSERT INTO daily_rollup (date, water_ml, water_logs) VALUES (?, ?, ?) "
+            "ON CONFLICT(date) DO UPDATE SET water_ml = water_ml + excluded.water_ml, "
+            "water_logs = water_logs + excluded.water_logs",
+            [(day, float(total), int(count)) for day, total, count in totals.itertuples()]
+        )
+    else:
+        # Rows arrive in logging order, so REPLACE keeps the last status per habit
+        conn.executemany(
+            "INSERT OR REPLACE INTO daily_habit_status (date, habit_name, status) VALUES (?, ?, ?)",
+            zip(batch['day'], batch['habit_name'].astype(str), batch['status'].astype(str))
+        )
+        _refresh_habit_days(conn, batch['day'].unique())
+    _drop_frame()
+
+def apply(worksheet_name, rows):
+    """
+    apply_rows() in its own transaction, for writes that don't go through
+    the local tables (Sheets backend).
+    """
+    with local_store.transaction() as conn:
+        apply_rows(conn, worksheet_name, rows)
+
+def aggregate(nutrition_df, water_df, habits_df):
+    """
+    Computes the rollup from full (typed) logs. Returns (daily, habit_status).
+    """
+    parts = []
+    if not nutrition_df.empty and 'date' in nutrition_df.columns:
+        nutrition = nutrition_df[nutrition_df['date'].notna()]
+        cols = [c for c in NUTRITION_COLS if c in nutrition.columns]
+        by_day = nutrition[cols].astype('float64').groupby(nutrition['date'])
+        parts.append(by_day.sum().assign(meals=by_day.size()))
+    if not water_df.empty and 'amount_ml' in water_df.columns:
+        water = water_df[water_df['date'].notna()]
+        parts.append(
+            water['amount_ml'].astype('float64').groupby(water['date']).agg(['sum', 'size'])
+            .rename(columns={'sum': 'water_ml', 'size': 'water_logs'})
+        )
+
+    habit_status = pd.DataFrame(columns=['date', 'habit_name', 'status'])
+    if not habits_df.empty and 'habit_name' in habits_df.columns:
+        habits = habits_df[habits_df['date'].notna()]
+        # Stable sort keeps same-day rows in logging order ("last entry wins")
+        latest = (
+            habits.sort_values('date', kind='mergesort')
+            .drop_duplicates(subset=['date', 'habit_name'], keep='last')
+        )
+        names = latest['habit_name'].astype(str)
+        completed = latest['status'].astype(str) == "Completado"
+        per_row = pd.DataFrame({
+            'elite_completed': (completed & names.isin(settings.ELITE_HABITS)).astype('int64'),
+            'workout': (completed & names.str.contains("ENTRENAMIENTO", case=False, regex=False)).astype('int64'),
+        })
+        parts.append(per_row.groupby(latest['date'].values).agg({'elite_completed': 'sum', 'workout': 'max'}))
+        habit_status = pd.DataFrame({
+            'date': latest['date'].dt.strftime(settings.DATE_FORMAT),
+            'habit_name': names,
+            'status': latest['status'].astype(str),
+        })
+
+    if parts:
+        daily = pd.concat(parts, axis=1).reindex(columns=COLUMNS).fillna(0)
+    else:
+        daily = pd.DataFrame(columns=COLUMNS, dtype='float64')
+    daily.index = pd.DatetimeIndex(daily.index, name='date')
+    return daily.sort_index(), habit_status
+
+def rebuild(nutrition_df, water_df, habits_df, versions=None):
+    """
+    Replaces the rollup with totals computed from the full logs.
+    versions: state of each source the rollup now reflects (see is_current()).
+    """
+    init()
+    daily, habit_status = aggregate(nutrition_df, water_df, habits_df)
+    # INTEGER columns store whole floats as integers
+    records = [
+        (day.strftime(settings.DATE_FORMAT), *map(float, values))
+        for day, values in zip(daily.index, daily[COLUMNS].itertuples(index=False))
+    ]
+    with local_store.transaction() as conn:
+        conn.execute("DELETE FROM daily_rollup")
+        conn.execute("DELETE FROM daily_habit_status")
+        conn.executemany(
+            f"INSERT INTO daily_rollup (date, {', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in range(len(COLUMNS) + 1))})",
+            records
+        )
+        conn.executemany(
+            "INSERT INTO daily_habit_status (date, habit_name, status) VALUES (?, ?, ?)",
+            habit_status.itertuples(index=False, name=None)
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO rollup_meta (key, value) VALUES ('versions', ?)",
+            (json.dumps(versions or {}, sort_keys=True),)
+        )
+    _drop_frame()
+
+def invalidate():
+    """
+    Forces a rebuild on the next read.
+    """
+    init()
+    with local_store.transaction() as conn:
+        conn.execute("DELETE FROM rollup_meta WHERE key = 'versions'")
+    _drop_frame()
+
+def _recorded(conn):
+    row = conn.execute("SELECT value FROM rollup_meta WHERE key = 'versions'").fetchone()
+    return None if row is None else json.loads(row[0])
+
+def _normalized(value):
+    # What the value reads back as once stored (tuples become lists, ...)
+    return json.loads(json.dumps(value, sort_keys=True, default=str))
+
+def is_built():
+    """
+    True if the rollup has been built at least once (current or not).
+    """
+    init()
+    return _recorded(local_store.get_connection()) is not None
+
+def is_current(versions=None):
+    """
+    True if the rollup has been built and reflects the given source states
+    (any JSON-serializable value per source).
+    """
+    init()
+    return _recorded(local_store.get_connection()) == _normalized(versions or {})
+
+def advance(worksheet_name, before, after):
+    """
+    Records that a source went from state `before` to `after` because of our
+    own write, whose rows were already applied: if the rollup reflected
+    `before`, it stays current and no rebuild is needed. Otherwise something
+    else changed too, and the next read rebuilds.
+    """
+    if worksheet_name not in SOURCES:
+        return
+    init()
+    with local_store.transaction() as conn:
+        versions = _recorded(conn)
+        if versions is None or versions.get(worksheet_name) != _normalized(before):
+            return
+        versions[worksheet_name] = _normalized(after)
+        conn.execute(
+            "UPDATE rollup_meta SET value = ? WHERE key = 'versions'",
+            (json.dumps(versions, sort_keys=True),)
+        )
+
+def _read_table():
+    df = pd.read_sql_query(
+        f"SELECT date, {', '.join(COLUMNS)} FROM daily_rollup ORDER BY date",
+        local_store.get_connection()
+    )
+    index = pd.DatetimeIndex(pd.to_datetime(df.pop('date'), format=settings.DATE_FORMAT), name='date')
+    df.index = index
+    return df.astype({
+        **{c: 'float64' for c in NUTRITION_COLS + ["water_ml"]},
+        "meals": 'int64', "water_logs": 'int64', "elite_completed": 'int64', "workout": 'bool',
+    })
+
+def load(start=None, end=None):
+    """
+    Per-day totals indexed by day (DatetimeIndex 'date'), optionally limited
+    to [start, end]. Days with nothing logged are absent.
+    """
+    global _frame
+    init()
+    with _frame_lock:
+        if _frame is None:
+            _frame = _read_table()
+        frame = _frame
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    return frame.loc[start:end].copy()
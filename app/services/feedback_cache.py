@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import streamlit as st
+from app.config import settings
+
+# Persistent cache of generated texts (AI coach messages), shared by every
+# process that opens the same SQLite file. Entries expire after a TTL and the
+# least recently used ones are evicted past FEEDBACK_CACHE_MAX_ENTRIES.
+# A short lease lets one caller generate a missing entry while the others
+# wait for it, so the same key never triggers two LLM calls.
+
+LEASE_SECONDS = 30
+POLL_SECONDS = 0.25
+
+_lock = threading.Lock()
+
+@st.cache_resource
+def get_connection():
+    """
+    Opens the cache database once per process.
+    """
+    os.makedirs(os.path.dirname(settings.FEEDBACK_CACHE_PATH), exist_ok=True)
+    conn = sqlite3.connect(settings.FEEDBACK_CACHE_PATH, check_same_thread=False, isolation_level=None, timeout=5)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS feedback (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS feedback_last_used ON feedback (last_used_at)")
+    conn.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+    return conn
+
+def make_key(signature):
+    """
+    Stable key for a JSON-serializable signature (dict keys are sorted).
+    """
+    payload = json.dumps(signature, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get(key):
+    """
+    Returns the cached text for key, or None if missing/expired.
+    """
+    now = time.time()
+    conn = get_connection()
+    with _lock:
+        row = conn.execute(
+            "SELECT value FROM feedback WHERE key = ? AND created_at > ?",
+            (key, now - settings.FEEDBACK_CACHE_TTL_SECONDS)
+        ).fetchone()
+        if row is not None:
+            conn.execute("UPDATE feedback SET last_used_at = ?, hits = hits + 1 WHERE key = ?", (now, key))
+    return row[0] if row else None
+
+def put(key, value):
+    """
+    Stores a text, then drops expired entries and the least recently used
+    ones beyond the size limit.
+    """
+    now = time.time()
+    conn = get_connection()
+    with _lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO feedback (key, value, created_at, last_used_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            conn.execute("DELETE FROM feedback WHERE created_at <= ?", (now - settings.FEEDBACK_CACHE_TTL_SECONDS,))
+            conn.execute(
+                "DELETE FROM feedback WHERE key IN ("
+                "SELECT key FROM feedback ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (settings.FEEDBACK_CACHE_MAX_ENTRIES,)
+            )
+            conn.execute("DELETE FROM leases WHERE key = ? OR expires_at <= ?", (key, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+def _acquire(key):
+    now = time.time()
+    conn = get_connection()
+    with _lock:
+        conn.execute("DELETE FROM leases WHERE key = ? AND expires_at <= ?", (key, now))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO leases (key, expires_at) VALUES (?, ?)",
+            (key, now + LEASE_SECONDS)
+        )
+    return cursor.rowcount == 1
+
+def _release(key):
+    with _lock:
+        get_connection().execute("DELETE FROM leases WHERE key = ?", (key,))
+
+def get_or_create(key, create, wait_seconds=LEASE_SECONDS):
+    """
+    Returns the cached text for key, calling create() at most once across all
+    processes sharing the cache. create() may return None to signal a failure
+    that must not be cached; get_or_create() then returns None as well.
+    """
+    value = get(key)
+    if value is not None:
+        return value
+
+    deadline = time.time() + wait_seconds
+    while not _acquire(key):
+        # Someone else is generating it
+        time.sleep(POLL_SECONDS)
+        value = get(key)
+        if value is not None:
+            return value
+        if time.time() >= deadline:
+            return None
+
+    try:
+        # It may have landed while we were acquiring the lease
+        value = get(key)
+        if value is None:
+            value = create()
+            if value is not None:
+                put(key, value)
+        return value
+    finally:
+        _release(key)
+
+def stats():
+    """
+    Entry count and total hits, for diagnostics.
+    """
+    with _lock:
+        entries, hits = get_connection().execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM feedback").fetchone()
+    return {"entries": entries, "hits": hits}
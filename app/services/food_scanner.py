@@ -0,0 +1,28 @@
+from app.config import settings
+from app.services import vision_service
+from app.services import gemini_service
+
+# Meal photo scanner as a cascade: the local pre-filter (vision_service.prefilter,
+# a few tens of ms) rejects unusable or non-food photos and answers simple
+# single-food photos itself; only the rest costs a Gemini round trip.
+
+def scan(image, user_context="", use_prefilter=True):
+    """
+    Analyzes a meal photo (bytes from image_service.preprocess_image()).
+    Returns a dict: decision (vision_service.REJECT, LOCAL or GEMINI),
+    reason (why it was rejected) and items, an iterable of food dicts
+    (streamed from Gemini for GEMINI, see gemini_service.stream_image_analysis).
+    With user context (e.g. "frito") the photo always goes to Gemini, which
+    can adjust the numbers; the local table can't.
+    """
+    if use_prefilter and settings.PREFILTER_ENABLED:
+        verdict = vision_service.prefilter(image)
+        if verdict["decision"] == vision_service.REJECT:
+            return verdict
+        if verdict["decision"] == vision_service.LOCAL and not (user_context or "").strip():
+            return verdict
+    return {
+        "decision": vision_service.GEMINI,
+        "reason": None,
+        "items": gemini_service.stream_image_analysis(image, user_context),
+    }
@@ -2,112 +2,373 @@ import streamlit as st
 import google.generativeai as genai
 from PIL import Image
 import json
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.config import settings
+from app.services import model_registry
+from app.services import image_cache
+from app.services import image_service
 
 # Try to configure Gemini if key is present
 API_KEY = st.secrets.get("GOOGLE_API_KEY")
 if API_KEY:
     genai.configure(api_key=API_KEY)
 
-def analyze_image_with_gemini(image, user_context=""):
+# Models to try, in order of preference and stability
+# Using specific models available for this user's API key
+PREFERRED_MODELS = [
+    'gemini-2.5-flash',
+    'gemini-2.0-flash',
+    'gemini-1.5-flash',
+    'gemini-1.5-pro'
+]
+
+# image_cache namespace; bump it when the prompt changes so old answers aren't reused
+CACHE_NAMESPACE = "gemini-v2"
+
+# Structured output: short keys in the schema (fewer output tokens), expanded
+# to the names the rest of the app uses
+COMPACT_FIELDS = {
+    "n": "name",
+    "g": "estimated_grams",
+    "kcal": "calories",
+    "p": "protein",
+    "c": "carbs",
+    "f": "fats",
+}
+RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "n": {"type": "STRING"},
+            "g": {"type": "NUMBER"},
+            "kcal": {"type": "NUMBER"},
+            "p": {"type": "NUMBER"},
+            "c": {"type": "NUMBER"},
+            "f": {"type": "NUMBER"},
+        },
+        "required": list(COMPACT_FIELDS),
+    },
+}
+
+def _build_prompt(user_context):
+    if settings.GEMINI_STRUCTURED_OUTPUT:
+        # The response schema defines the format
+        return f"""
+    Actúa como un nutriólogo experto. Identifica los alimentos de esta imagen de comida.
+    Para cada uno: n = nombre en ESPAÑOL, g = gramos estimados, kcal = calorías,
+    p = proteína (g), c = carbohidratos (g), f = grasas (g).
+    Usa el contexto para ajustar las calorías (ej: si es frito, aumenta grasas).
+    Contexto adicional del usuario: "{user_context if user_context else 'Ninguno'}"
+    Si la imagen no es comida, retorna [].
     """
-    Sends the image to Google Gemini to identify food and estimate nutrition.
-    Returns a list of dictionaries with food details.
+    return f"""
+    Actúa como un nutriólogo experto. Analiza esta imagen de comida.
+    
+    Contexto adicional del usuario: "{user_context if user_context else 'Ninguno'}"
+    
+    Identifica los alimentos presentes.
+    Para cada alimento, estima el peso en gramos y el contenido nutricional (calorías, proteína, carbohidratos, grasas).
+    Usa el contexto para ajustar las calorías (ej: si es frito, aumenta grasas).
+    
+    Retorna SOLO una lista JSON pura de objetos. NO uses bloques de código markdown.
+    Los nombres de los alimentos DEBEN estar en ESPAÑOL.
+    
+    Formato:
+    [
+        {{
+            "name": "Pechuga de Pollo Asada",
+            "estimated_grams": 150,
+            "calories": 250,
+            "protein": 45,
+            "carbs": 0,
+            "fats": 5
+        }},
+        ...
+    ]
+    Si la imagen no es comida, retorna una lista vacía [].
     """
-    if not API_KEY:
-        st.error("⚠️ Falta la GOOGLE_API_KEY en los secretos.")
-        return [], None
 
-    # Try multiple models in order of preference and stability
-    # Using specific models available for this user's API key
-    models_to_try = [
-        'gemini-2.5-flash',
-        'gemini-2.0-flash',
-        'gemini-1.5-flash',
-        'gemini-1.5-pro'
+def _generation_config():
+    if not settings.GEMINI_STRUCTURED_OUTPUT:
+        return None
+    return genai.GenerationConfig(response_mime_type="application/json", response_schema=RESPONSE_SCHEMA)
+
+def _to_number(value, digits):
+    try:
+        return round(float(value), digits) if digits else int(round(float(value)))
+    except (TypeError, ValueError):
+        return 0
+
+def _normalize_item(obj):
+    """
+    Item with the app's field names (compact or full keys accepted),
+    or None if it isn't a named food.
+    """
+    if not isinstance(obj, dict):
+        return None
+    item = {full: obj.get(short, obj.get(full)) for short, full in COMPACT_FIELDS.items()}
+    if not item["name"]:
+        return None
+    item["name"] = str(item["name"])
+    item["estimated_grams"] = _to_number(item["estimated_grams"], 0)
+    item["calories"] = _to_number(item["calories"], 0)
+    for field in ("protein", "carbs", "fats"):
+        item[field] = _to_number(item[field], 1)
+    return item
+
+class ItemStreamParser:
+    """
+    Incremental parser for a streamed JSON list of objects: feed() returns
+    each object as soon as its closing brace arrives. Text before the list
+    (e.g. a markdown fence) is skipped, and an object that isn't valid JSON
+    is dropped on its own instead of failing the whole answer.
+    """
+    def __init__(self):
+        self.started = False
+        self.complete = False
+        self.invalid = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._buffer = []
+
+    def feed(self, text):
+        items = []
+        for char in text:
+            if self.complete:
+                break
+            if not self.started:
+                if char == "[":
+                    self.started, self._depth = True, 1
+                continue
+            if self._depth == 1:
+                # Between list elements
+                if char == "{":
+                    self._depth = 2
+                    self._buffer = [char]
+                elif char == "]":
+                    self.complete = True
+                continue
+
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 1:
+                    try:
+                        item = _normalize_item(json.loads("".join(self._buffer)))
+                    except ValueError:
+                        item = None
+                    if item is None:
+                        self.invalid += 1
+                    else:
+                        items.append(item)
+                    self._buffer = []
+        return items
+
+def _discover_models():
+    """
+    Vision-capable models reported by list_models() (cached by the registry).
+    """
+    def fetch():
+        return [
+            m.name for m in genai.list_models()
+            if 'generateContent' in m.supported_generation_methods
+        ]
+    return [
+        name for name in model_registry.list_models(fetch)
+        if 'vision' in name or 'flash' in name or 'pro' in name
     ]
 
-    last_error = None
-
-    for model_name in models_to_try:
-        try:
-            # For some older accounts or regions, we might need to be explicit about the generation config or API version
-            # But genai library handles most of it.
-            # Let's try to list models first if this loop fails completely, but for now just try the model.
-            
-            # Use the model name directly
-            model = genai.GenerativeModel(model_name)
-            
-            prompt = f"""
-            Actúa como un nutriólogo experto. Analiza esta imagen de comida.
-            
-            Contexto adicional del usuario: "{user_context if user_context else 'Ninguno'}"
-            
-            Identifica los alimentos presentes.
-            Para cada alimento, estima el peso en gramos y el contenido nutricional (calorías, proteína, carbohidratos, grasas).
-            Usa el contexto para ajustar las calorías (ej: si es frito, aumenta grasas).
-            
-            Retorna SOLO una lista JSON pura de objetos. NO uses bloques de código markdown.
-            Los nombres de los alimentos DEBEN estar en ESPAÑOL.
-            
-            Formato:
-            [
-                {{
-                    "name": "Pechuga de Pollo Asada",
-                    "estimated_grams": 150,
-                    "calories": 250,
-                    "protein": 45,
-                    "carbs": 0,
-                    "fats": 5
-                }},
-                ...
-            ]
-            Si la imagen no es comida, retorna una lista vacía [].
-            """
-            
-            response = model.generate_content([prompt, image])
-            
-            # Clean response text (remove markdown if present)
-            text_response = response.text.strip()
-            if text_response.startswith("```json"):
-                text_response = text_response[7:]
-            if text_response.endswith("```"):
-                text_response = text_response[:-3]
-                
-            return json.loads(text_response), image
-            
-        except Exception as e:
-            last_error = str(e)
-            continue # Try next model
-
-    # If all models failed, try to list available models to debug
+@st.cache_resource
+def get_executor():
+    """
+    Workers for parallel (hedged) model calls, shared by every session.
+    """
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="gemini")
+
+class _Race:
+    """
+    Shared state of one hedged analysis: the first model to produce an item
+    (or a complete empty list) wins; the others stop at their next chunk.
+    Workers report through `events`: ("item" | "done" | "error", model, payload).
+    """
+    def __init__(self):
+        self.events = queue.Queue()
+        self.winner = None
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def claim(self, model_name):
+        with self._lock:
+            if self.winner is None and not self.cancelled:
+                self.winner = model_name
+            return self.winner == model_name and not self.cancelled
+
+def _stream_model(model_name, prompt, image, race, deadline):
+    """
+    One streamed model call; reports the model's health to the registry.
+    Incomplete or invalid JSON is reported as an error, but doesn't count
+    as a model failure. The request times out at `deadline`, so a hung call
+    can't hold a worker (or a half-open probe) past the analysis.
+    """
+    if race.cancelled or race.winner is not None:
+        # Hedge still queued when the race ended: don't pay for a request
+        model_registry.release(model_name)
+        return
+    parser = ItemStreamParser()
+    lost = False
     try:
-        st.error(f"Error analizando con Gemini (se probaron varios modelos). Último error: {last_error}")
-        st.warning("Intentando listar modelos disponibles para tu clave API...")
-        
-        available_models = []
-        for m in genai.list_models():
-            if 'generateContent' in m.supported_generation_methods:
-                available_models.append(m.name)
-                
-        if available_models:
-            st.info(f"Modelos disponibles encontrados: {', '.join(available_models)}")
-            # Try the first available vision model
-            for m_name in available_models:
-                if 'vision' in m_name or 'flash' in m_name or 'pro' in m_name:
-                    st.success(f"Intentando con modelo descubierto: {m_name}")
-                    model = genai.GenerativeModel(m_name)
-                    response = model.generate_content([prompt, image])
-                    # Clean response text (remove markdown if present)
-                    text_response = response.text.strip()
-                    if text_response.startswith("```json"):
-                        text_response = text_response[7:]
-                    if text_response.endswith("```"):
-                        text_response = text_response[:-3]
-                    return json.loads(text_response), image
-        else:
-            st.error("No se encontraron modelos compatibles con 'generateContent' para tu API Key.")
-            
-    except Exception as e_debug:
-        st.error(f"Error al listar modelos: {str(e_debug)}")
-
-    return [], image
+        model = genai.GenerativeModel(model_name, generation_config=_generation_config())
+        timeout = max(1.0, deadline - time.monotonic())
+        response = model.generate_content([prompt, image], stream=True, request_options={"timeout": timeout})
+        for chunk in response:
+            for item in parser.feed(chunk.text):
+                if not race.claim(model_name):
+                    lost = True
+                    break
+                race.events.put(("item", model_name, item))
+            if lost or race.cancelled:
+                break
+    except Exception as e:
+        model_registry.record_failure(model_name, e)
+        race.events.put(("error", model_name, e))
+        return
+    model_registry.record_success(model_name)
+    if lost or race.cancelled:
+        return
+    if not parser.complete:
+        race.events.put(("error", model_name, "Respuesta JSON incompleta o inválida"))
+    elif race.claim(model_name):
+        race.events.put(("done", model_name, None))
+
+def _try_models(model_names, prompt, image, deadline, outcome):
+    """
+    Hedged streaming requests: starts with the first model the registry lets
+    through; if no model has produced anything after
+    GEMINI_HEDGE_DELAY_SECONDS, and whenever one fails, the next one is
+    started in parallel. Yields the items of the first model to answer, as
+    they arrive; the other calls are abandoned. Gives up at `deadline`
+    (time.monotonic()).
+    outcome: dict updated with "complete" (the whole list arrived) and
+    "error" (last error seen).
+    """
+    pending_models = iter(model_names)
+    running = set()
+    race = _Race()
+
+    def launch_next():
+        for model_name in pending_models:
+            if model_registry.acquire(model_name):
+                running.add(model_name)
+                get_executor().submit(_stream_model, model_name, prompt, image, race, deadline)
+                return True
+            # Known to be failing, skip without paying for a request
+        return False
+
+    launch_next()
+    try:
+        while running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                outcome["error"] = outcome["error"] or "Tiempo de espera agotado"
+                return
+            try:
+                kind, model_name, payload = race.events.get(timeout=min(settings.GEMINI_HEDGE_DELAY_SECONDS, remaining))
+            except queue.Empty:
+                if race.winner is None:
+                    # Slow answer: hedge with the next model
+                    launch_next()
+                continue
+            if kind == "item":
+                yield payload
+            elif kind == "done":
+                outcome["complete"] = True
+                return
+            else:
+                running.discard(model_name)
+                outcome["error"] = f"{model_name}: {payload}"
+                if model_name == race.winner:
+                    # Cut off mid-answer: keep what already arrived
+                    return
+                # Replace the failed model right away, even if others are still running
+                launch_next()
+    finally:
+        race.cancelled = True
+
+def stream_image_analysis(image, user_context=""):
+    """
+    Sends the image to Google Gemini to identify food and estimate nutrition,
+    yielding each food (dict with name, estimated_grams, calories, protein,
+    carbs, fats) as soon as the model has finished describing it.
+    image: PIL image or uploaded file (preprocessed here), or bytes already
+    returned by image_service.preprocess_image().
+    Models that are currently failing are skipped (see model_registry) and
+    slow ones are hedged with the next model (see _try_models).
+    The same photo with the same context is answered from image_cache;
+    failed or cut-off analyses are not cached.
+    """
+    if not API_KEY:
+        st.error("⚠️ Falta la GOOGLE_API_KEY en los secretos.")
+        return
+
+    # Models get the compact preprocessed photo, not the original upload
+    if not isinstance(image, bytes):
+        image = image_service.preprocess_image(image)
+    image_part = {"mime_type": image_service.mime_type(image), "data": image}
+
+    image_key = image_cache.image_hash(image_service.open_image(image))
+    cached = image_cache.get(CACHE_NAMESPACE, image_key, user_context)
+    if cached is not None:
+        yield from cached
+        return
+
+    prompt = _build_prompt(user_context)
+    deadline = time.monotonic() + settings.GEMINI_DEADLINE_SECONDS
+    outcome = {"complete": False, "error": None}
+    items = []
+    for item in _try_models(PREFERRED_MODELS, prompt, image_part, deadline, outcome):
+        items.append(item)
+        yield item
+
+    if not outcome["complete"] and not items and time.monotonic() < deadline:
+        # All preferred models failed or are skipped: try other models available to this key
+        discovered = [name for name in _discover_models() if name not in PREFERRED_MODELS]
+        for item in _try_models(discovered, prompt, image_part, deadline, outcome):
+            items.append(item)
+            yield item
+
+    if outcome["complete"]:
+        image_cache.put(CACHE_NAMESPACE, image_key, items, user_context)
+    elif items:
+        st.warning("La respuesta de Gemini se cortó: revisa que no falte ningún alimento.")
+    elif outcome["error"]:
+        st.error(f"Error analizando con Gemini (se probaron varios modelos). Último error: {outcome['error']}")
+    else:
+        st.error("Todos los modelos de Gemini están fallando ahora mismo. Intenta de nuevo en unos minutos.")
+
+def analyze_image_with_gemini(image, user_context=""):
+    """
+    Blocking version of stream_image_analysis().
+    Returns (list of food dicts, preprocessed image bytes).
+    """
+    if not API_KEY:
+        st.error("⚠️ Falta la GOOGLE_API_KEY en los secretos.")
+        return [], None
+    if not isinstance(image, bytes):
+        image = image_service.preprocess_image(image)
+    return list(stream_image_analysis(image, user_context)), image
@@ -1,98 +1,596 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import requests
+from google.oauth2.service_account import Credentials
+from google.auth.exceptions import RefreshError
 import streamlit as st
 import pandas as pd
 from app.config import settings
+from app.services import sheets_quota
+from app.services import shared_cache
+from app.services import schema
 
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+
+CACHE_TTL_SECONDS = 60
+MAX_WRITE_ATTEMPTS = 3
+
+# Process-wide worksheet cache: {worksheet_name: entry}, see _make_entry()
+_frames = {}
+_cache_lock = threading.Lock()
+# Serializes fetches so concurrent sessions don't download the same sheets twice
+_fetch_lock = threading.Lock()
+# Known header row per worksheet, so appends don't have to read it first
+_headers = {}
+
+@st.cache_resource
 def get_client():
     """
     Authenticates with Google Sheets using secrets.
+    Cached once per process: google-auth refreshes the access token on its own,
+    so every session and rerun shares the same authorized client.
     """
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    
     # Load credentials from Streamlit secrets
-    creds_dict = st.secrets["gcp_service_account"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    client = gspread.authorize(creds)
-    return client
+    creds_dict = dict(st.secrets["gcp_service_account"])
+    creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
+    return gspread.authorize(creds)
+
+@st.cache_resource
+def get_spreadsheet():
+    """
+    Returns the configured Spreadsheet handle (opened once per process).
+    """
+    sheet_name = st.secrets["spreadsheet"]["name"]
+    return get_client().open(sheet_name)
+
+@st.cache_resource
+def get_worksheet(worksheet_name):
+    """
+    Returns a cached Worksheet handle.
+    Raises gspread.WorksheetNotFound (not cached) if it doesn't exist.
+    """
+    return get_spreadsheet().worksheet(worksheet_name)
+
+def reset_connection():
+    """
+    Drops the pooled client and every cached Spreadsheet/Worksheet handle.
+    The next call re-authenticates from scratch.
+    """
+    get_worksheet.clear()
+    get_spreadsheet.clear()
+    get_client.clear()
+
+def _is_auth_error(e):
+    if isinstance(e, RefreshError):
+        return True
+    return isinstance(e, gspread.exceptions.APIError) and e.code == 401
+
+def _with_reconnect(fn, metered=True):
+    """
+    Runs fn() through the quota scheduler, reconnecting once if the pooled
+    credentials were rejected.
+    fn must fetch its handles through get_worksheet()/get_spreadsheet().
+    fn is charged one token, so it should make a single API call; pass
+    metered=False for functions that charge each of their calls themselves.
+    """
+    run = (lambda: sheets_quota.call(fn)) if metered else fn
+    try:
+        return run()
+    except Exception as e:
+        if not _is_auth_error(e):
+            raise
+        reset_connection()
+        return run()
+
+def _reconcile_header(worksheet_name, header):
+    """
+    Checks a worksheet header against settings.SHEET_SCHEMAS and appends any
+    missing schema columns (e.g. row_id on sheets created before it existed).
+    Returns the header to use for writes.
+    Charges its own Sheets calls to the quota.
+    """
+    missing = [col for col in settings.SHEET_SCHEMAS.get(worksheet_name, []) if col not in header]
+    if not missing:
+        return header
+
+    ws = get_worksheet(worksheet_name)
+    new_header = header + missing
+    if ws.col_count < len(new_header):
+        sheets_quota.call(lambda: ws.add_cols(len(new_header) - ws.col_count))
+    sheets_quota.call(lambda: ws.update(values=[new_header], range_name="A1"))
+    clear_cache(worksheet_name)
+    return new_header
+
+def _get_headers(worksheet_name):
+    """
+    Returns the cached header row of a worksheet, reading it only on first use
+    or after a sync noticed that it changed. Charges its own Sheets calls
+    to the quota (none on a cache hit).
+    """
+    with _cache_lock:
+        headers = _headers.get(worksheet_name)
+    if headers is None:
+        first_row = sheets_quota.call(lambda: get_worksheet(worksheet_name).row_values(1))
+        headers = _reconcile_header(worksheet_name, _trim(first_row))
+        with _cache_lock:
+            _headers[worksheet_name] = headers
+    return headers
+
+@st.cache_resource
+def _ensure_worksheets():
+    """
+    Creates any missing worksheet and validates the headers of existing ones.
+    Cached so it runs once per process. Each Sheets call is charged to the
+    quota separately.
+    """
+    sh = get_spreadsheet()
+
+    existing_titles = [ws.title for ws in sheets_quota.call(sh.worksheets)]
+
+    for title, cols in settings.SHEET_SCHEMAS.items():
+        if title not in existing_titles:
+            ws = sheets_quota.call(lambda: sh.add_worksheet(title=title, rows=100, cols=len(cols)))
+            sheets_quota.call(lambda: ws.append_row(cols))
+            _headers[title] = list(cols)
 
-def init_sheets():
+    # One batched read for every existing header row
+    present = [title for title in settings.SHEET_SCHEMAS if title in existing_titles]
+    header_rows = sheets_quota.call(lambda: _batch_get([gspread.utils.absolute_range_name(title, "1:1") for title in present]))
+    for title, values in zip(present, header_rows):
+        header = _reconcile_header(title, _trim(values[0]) if values else [])
+        with _cache_lock:
+            _headers[title] = header
+    return True
+
+def init_sheets(force=False):
     """
     Initializes the Google Sheet and required worksheets if they don't exist.
+    Runs once per process; force=True re-checks the spreadsheet.
     """
-    client = get_client()
+    if force:
+        _ensure_worksheets.clear()
     try:
-        # Try to open existing sheet
-        sheet_name = st.secrets["spreadsheet"]["name"]
-        sh = client.open(sheet_name)
+        _with_reconnect(_ensure_worksheets, metered=False)
     except gspread.SpreadsheetNotFound:
+        sheet_name = st.secrets["spreadsheet"]["name"]
         st.error(f"Spreadsheet '{sheet_name}' not found. Please create it and share with service account email.")
+
+def _values_to_frame(worksheet_name, values):
+    """
+    Builds a typed DataFrame from raw worksheet values (first row = headers),
+    padding short rows the same way get_all_records does.
+    """
+    if not values:
+        return pd.DataFrame()
+    headers = values[0]
+    width = len(headers)
+    rows = [list(row[:width]) + [""] * (width - len(row)) for row in values[1:]]
+    return _drop_duplicate_ids(schema.coerce(worksheet_name, pd.DataFrame(rows, columns=headers)))
+
+def _drop_duplicate_ids(frame):
+    """
+    Keeps the first row of each row_id, in case a retried append landed twice.
+    Legacy rows without an id are left alone.
+    """
+    if settings.ROW_ID not in frame.columns:
+        return frame
+    ids = frame[settings.ROW_ID]
+    keep = (ids == "") | ~ids.duplicated()
+    return frame if keep.all() else frame[keep].reset_index(drop=True)
+
+def _batch_get(ranges):
+    """
+    Reads several A1 ranges in a single values:batchGet request.
+    Returns one list of rows per range, in request order.
+    """
+    response = get_spreadsheet().values_batch_get(
+        ranges, params={"valueRenderOption": "UNFORMATTED_VALUE"}
+    )
+    return [vr.get("values", []) for vr in response.get("valueRanges", [])]
+
+def _fetch_one(worksheet_name):
+    return get_worksheet(worksheet_name).get_values(
+        value_render_option=gspread.utils.ValueRenderOption.unformatted
+    )
+
+def _trim(row):
+    """
+    Drops trailing blanks (the API omits them, get_values pads them).
+    """
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+def _column_letter(width):
+    return gspread.utils.rowcol_to_a1(1, max(width, 1)).rstrip("0123456789")
+
+def _make_entry(worksheet_name, values):
+    """
+    Cache entry for a fully downloaded worksheet.
+    row_count counts the header row, i.e. it is the last used row number.
+    digest fingerprints the full download (kept by tail syncs and writes),
+    so a reload that found different rows is told apart from the old copy.
+    """
+    return {
+        "loaded_at": time.monotonic(),
+        "frame": _values_to_frame(worksheet_name, values),
+        "header": _trim(values[0]) if values else [],
+        "row_count": len(values),
+        "last_row": _trim(values[-1]) if values else [],
+        "digest": hashlib.sha1(json.dumps(values, default=str).encode("utf-8")).hexdigest(),
+    }
+
+def _tail_ranges(worksheet_name, entry):
+    """
+    Header row plus everything from the last known row to the end.
+    Re-reading the last known row lets us detect deletions/edits.
+    """
+    last_col = _column_letter(len(entry["header"]))
+    return [
+        gspread.utils.absolute_range_name(worksheet_name, "1:1"),
+        gspread.utils.absolute_range_name(worksheet_name, f"A{entry['row_count']}:{last_col}"),
+    ]
+
+def _merge_tail(worksheet_name, entry, header_values, tail):
+    """
+    Applies an incremental read to a cache entry.
+    Returns the updated entry, or None when a full reload is needed
+    (header changed, or the last known row is gone/different).
+    """
+    header = _trim(header_values[0]) if header_values else []
+    if header != entry["header"] or not tail or _trim(tail[0]) != entry["last_row"]:
+        return None
+
+    new_rows = tail[1:]
+    frame = entry["frame"]
+    if new_rows:
+        new_frame = _values_to_frame(worksheet_name, [entry["header"]] + new_rows)
+        frame = _drop_duplicate_ids(schema.concat(worksheet_name, frame, new_frame))
+
+    return {
+        "loaded_at": time.monotonic(),
+        "frame": frame,
+        "header": entry["header"],
+        "row_count": entry["row_count"] + len(new_rows),
+        "last_row": _trim(new_rows[-1]) if new_rows else entry["last_row"],
+        "digest": entry["digest"],
+    }
+
+def _sync(worksheet_names):
+    """
+    Brings the given worksheets up to date in as few round trips as possible.
+    Worksheets with a stale cache entry only download the rows appended since
+    the last sync; the rest are downloaded in full. Everything goes out in one
+    batched request (plus a second one only if some tail check failed).
+    """
+    with _cache_lock:
+        stale = {name: _frames[name] for name in worksheet_names if name in _frames}
+    fresh = [name for name in worksheet_names if name not in stale]
+
+    ranges = []
+    for name, entry in stale.items():
+        ranges.extend(_tail_ranges(name, entry))
+    ranges.extend(gspread.utils.absolute_range_name(name) for name in fresh)
+
+    updated = {}
+    try:
+        results = _with_reconnect(lambda: _batch_get(ranges))
+
+        reload = []
+        for i, (name, entry) in enumerate(stale.items()):
+            merged = _merge_tail(name, entry, results[2 * i], results[2 * i + 1])
+            if merged is None:
+                reload.append(name)  # header changed or rows were removed
+            else:
+                updated[name] = merged
+        for name, values in zip(fresh, results[2 * len(stale):]):
+            updated[name] = _make_entry(name, values)
+
+        if reload:
+            values_list = _with_reconnect(lambda: _batch_get(
+                [gspread.utils.absolute_range_name(name) for name in reload]
+            ))
+            for name, values in zip(reload, values_list):
+                updated[name] = _make_entry(name, values)
+    except Exception:
+        # One missing/broken worksheet fails the whole batch: retry one by one
+        for name in worksheet_names:
+            if name in updated:
+                continue
+            try:
+                updated[name] = _make_entry(name, _with_reconnect(lambda: _fetch_one(name)))
+            except Exception:
+                pass
+
+    with _cache_lock:
+        _frames.update(updated)
+        for name, entry in updated.items():
+            # Header changed under us: re-validate it before the next write
+            if _headers.get(name) not in (None, entry["header"]):
+                _headers.pop(name)
+    return updated
+
+def _shareable(worksheet_name):
+    """
+    Only worksheets with declared dtypes go to the shared tier: their frames
+    round-trip through Parquet unchanged. Untyped ones (user_profile, goals)
+    keep the raw cell types (numbers next to "" blanks), which Parquet can't.
+    """
+    return worksheet_name in settings.SHEET_DTYPES
+
+def _shared_key(worksheet_name, version):
+    return f"sheets:{worksheet_name}:v{version}"
+
+def _publish(worksheet_name, entry, version):
+    """
+    Shares a synced entry with the other replicas under its data version.
+    """
+    meta = {
+        "header": entry["header"],
+        "row_count": entry["row_count"],
+        "last_row": entry["last_row"],
+        "digest": entry["digest"],
+        "synced_at": time.time(),
+    }
+    # No longer than the local TTL: edits made directly in the sheet don't
+    # bump the version, so the TTL is what bounds how stale a copy can be
+    try:
+        data = shared_cache.dumps_frame(entry["frame"], meta)
+    except Exception as e:
+        print(f"Error serializing {worksheet_name} for the shared cache: {e}")
         return
+    shared_cache.put(
+        _shared_key(worksheet_name, version),
+        data,
+        ttl=min(settings.SHARED_CACHE_TTL_SECONDS, CACHE_TTL_SECONDS)
+    )
 
-    # Define required worksheets and their columns
-    required_sheets = {
-        settings.SHEET_BODY_METRICS: settings.COLS_BODY,
-        settings.SHEET_NUTRITION_LOG: settings.COLS_NUTRITION,
-        settings.SHEET_WATER_LOG: settings.COLS_WATER,
-        settings.SHEET_MEDICATION_LOG: settings.COLS_MEDS,
-        settings.SHEET_HABITS_LOG: settings.COLS_HABITS,
-        settings.SHEET_GOALS: settings.COLS_GOALS,
-        settings.SHEET_PROFILE: settings.COLS_PROFILE
+def _from_shared(worksheet_name, version):
+    """
+    Cache entry published by any replica for this data version, or None.
+    """
+    data = shared_cache.get(_shared_key(worksheet_name, version))
+    if not data:
+        return None
+    try:
+        frame, meta = shared_cache.loads_frame(data)
+    except Exception:
+        return None
+    # Expires when the publisher's copy would have, not a full TTL from now
+    age = max(0.0, time.time() - meta.get("synced_at", 0))
+    if age >= CACHE_TTL_SECONDS:
+        return None
+    return {
+        "loaded_at": time.monotonic() - age,
+        "frame": frame,
+        "header": meta["header"],
+        "row_count": meta["row_count"],
+        "last_row": meta["last_row"],
+        "digest": meta.get("digest"),
     }
 
-    existing_titles = [ws.title for ws in sh.worksheets()]
+def _get_cached(worksheet_name):
+    entry = _frames.get(worksheet_name)
+    if entry and time.monotonic() - entry["loaded_at"] < CACHE_TTL_SECONDS:
+        return entry["frame"]
+    return None
 
-    for title, cols in required_sheets.items():
-        if title not in existing_titles:
-            ws = sh.add_worksheet(title=title, rows=100, cols=len(cols))
-            ws.append_row(cols)
-            # st.toast(f"Created worksheet: {title}")
+def clear_cache(worksheet_name=None):
+    """
+    Drops the cached DataFrame of one worksheet, or of all of them.
+    """
+    with _cache_lock:
+        if worksheet_name is None:
+            _frames.clear()
+        else:
+            _frames.pop(worksheet_name, None)
+
+def _appended_first_row(response):
+    """
+    First row number written by an append, from its updatedRange ('x'!A57:F58).
+    """
+    updated_range = (response or {}).get("updates", {}).get("updatedRange", "")
+    match = re.match(r"[A-Z]+(\d+)", updated_range.rsplit("!", 1)[-1])
+    return int(match.group(1)) if match else None
+
+def _write_through(worksheet_name, headers, rows, response):
+    """
+    Applies freshly appended rows to the cached frame so no re-read is needed.
+    If someone else appended in between (the rows didn't land right after
+    our last known row) or the header differs, the entry is dropped instead.
+    """
+    with _cache_lock:
+        entry = _frames.get(worksheet_name)
+        if entry is None:
+            return
+        if _trim(headers) != entry["header"] or _appended_first_row(response) != entry["row_count"] + 1:
+            _frames.pop(worksheet_name, None)
+            return
+
+        new_frame = _values_to_frame(worksheet_name, [entry["header"]] + rows)
+        frame = entry["frame"]
+        _frames[worksheet_name] = dict(
+            entry,
+            frame=_drop_duplicate_ids(schema.concat(worksheet_name, frame, new_frame)),
+            row_count=entry["row_count"] + len(rows),
+            last_row=_trim(rows[-1]),
+        )
+
+def _collect_cached(names, frames):
+    """
+    Fills frames with the cached entries and returns the names still missing.
+    """
+    missing = []
+    with _cache_lock:
+        for name in names:
+            cached = _get_cached(name)
+            if cached is None:
+                missing.append(name)
+            else:
+                frames[name] = cached
+    return missing
+
+def _load(names):
+    """
+    load_many() without the defensive copies.
+    """
+    frames = {}
+    missing = _collect_cached(names, frames)
+
+    if missing:
+        with _fetch_lock:
+            # Another session may have fetched them while we waited
+            missing = _collect_cached(missing, frames)
+            if missing:
+                # Second tier: another replica may already have synced this
+                # version. Only for worksheets this process has never loaded;
+                # an expired local entry is refreshed with a tail sync instead
+                versions = {name: shared_cache.get_version(name) for name in missing}
+                with _cache_lock:
+                    never_loaded = [name for name in missing if name not in _frames]
+                updated = {}
+                for name in filter(_shareable, never_loaded):
+                    entry = _from_shared(name, versions[name])
+                    if entry is not None:
+                        updated[name] = entry
+                with _cache_lock:
+                    _frames.update(updated)
+
+                to_sync = [name for name in missing if name not in updated]
+                if to_sync:
+                    synced = _sync(to_sync)
+                    for name, entry in synced.items():
+                        if _shareable(name):
+                            _publish(name, entry, versions[name])
+                    updated.update(synced)
+
+                with _cache_lock:
+                    for name in missing:
+                        if name in updated:
+                            frames[name] = updated[name]["frame"]
+                        elif name in _frames:
+                            # Sync failed (quota, network): serve the stale copy
+                            # rather than an empty "no data" frame
+                            frames[name] = _frames[name]["frame"]
+                        else:
+                            # Not cached, so the next render retries
+                            frames[name] = pd.DataFrame()
+    return frames
+
+def load_many(worksheet_names):
+    """
+    Loads several worksheets at once and returns {worksheet_name: DataFrame}.
+    Worksheets not already cached are synced in one batched round trip;
+    logs are append-only, so an expired entry only fetches its new rows.
+    Shares load_data's cache (60s TTL, callers get their own copy).
+    """
+    names = list(dict.fromkeys(worksheet_names))
+    frames = _load(names)
+    return {name: frames[name].copy() for name in names}
+
+def sync_states(worksheet_names, refresh=True):
+    """
+    What the last sync saw of each worksheet: {worksheet_name:
+    [row_count, last_row, digest]}, or None if it was never loaded.
+    Changes whenever the cached data does, our own appends included.
+    refresh=True first syncs expired entries, like load_many().
+    """
+    names = list(dict.fromkeys(worksheet_names))
+    if refresh:
+        _load(names)
+    with _cache_lock:
+        entries = {name: _frames.get(name) for name in names}
+    return {
+        name: None if entry is None else [entry["row_count"], entry["last_row"], entry["digest"]]
+        for name, entry in entries.items()
+    }
 
-@st.cache_data(ttl=60)
 def load_data(worksheet_name):
     """
     Loads data from a specific worksheet into a pandas DataFrame.
     Cached for 60 seconds to optimize Cloud Run performance.
     """
-    client = get_client()
+    return load_many([worksheet_name])[worksheet_name]
+
+def _is_transient(e):
+    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    return isinstance(e, gspread.exceptions.APIError) and (e.code == 429 or e.code >= 500)
+
+def _append_idempotent(worksheet_name, headers, values):
+    """
+    Appends values, retrying transient failures. Before each retry the row_id
+    column is checked so rows that did land on a timed-out attempt aren't
+    written twice. Returns the append response, or None if a retry happened
+    (the cache entry then can't be patched reliably).
+    """
+    id_index = headers.index(settings.ROW_ID) if settings.ROW_ID in headers else None
+    pending = values
+
+    for attempt in range(MAX_WRITE_ATTEMPTS):
+        try:
+            response = _with_reconnect(lambda: get_worksheet(worksheet_name).append_rows(pending))
+            return response if attempt == 0 else None
+        except Exception as e:
+            if not _is_transient(e) or id_index is None or attempt == MAX_WRITE_ATTEMPTS - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+            # The previous attempt may have been applied before the connection dropped
+            landed = set(_with_reconnect(lambda: get_worksheet(worksheet_name).col_values(id_index + 1)))
+            pending = [row for row in pending if row[id_index] not in landed]
+            if not pending:
+                return None
+
+def append_rows(worksheet_name, rows):
+    """
+    Appends several rows to the specified worksheet in a single request.
+    rows: list of dicts where keys match column names
+    Each row gets a row_id (unless it has one) so retries can't duplicate it.
+    Raises on failure; add_rows() is the UI-facing wrapper.
+    """
+    if not rows:
+        return
+
+    rows = [dict(row_data) for row_data in rows]
+    for row_data in rows:
+        row_data.setdefault(settings.ROW_ID, uuid.uuid4().hex)
+
+    headers = _with_reconnect(lambda: _get_headers(worksheet_name), metered=False)
+
+    # Prepare row values in order
+    values = [[row_data.get(col, "") for col in headers] for row_data in rows]
+
+    response = _append_idempotent(worksheet_name, headers, values)
+
+    # Outdates this worksheet's entries in the shared tier for every replica
+    shared_cache.bump_version(worksheet_name)
+
+    # Update only this worksheet's cache so the UI reflects the write
+    # without re-downloading anything
+    _write_through(worksheet_name, headers, values, response)
+
+def add_rows(worksheet_name, rows):
+    """
+    Appends several rows to the specified worksheet in a single request.
+    rows: list of dicts where keys match column names
+    """
     try:
-        sheet_name = st.secrets["spreadsheet"]["name"]
-        sh = client.open(sheet_name)
-        ws = sh.worksheet(worksheet_name)
-        data = ws.get_all_records()
-        return pd.DataFrame(data)
-    except gspread.WorksheetNotFound:
-        # st.warning(f"Worksheet {worksheet_name} not found.")
-        return pd.DataFrame()
+        append_rows(worksheet_name, rows)
+        return True
     except Exception as e:
-        # st.error(f"Error loading {worksheet_name}: {e}")
-        return pd.DataFrame()
+        st.error(f"Error adding rows to {worksheet_name}: {e}")
+        return False
 
 def add_row(worksheet_name, row_data):
     """
     Appends a row to the specified worksheet.
     row_data: dict where keys match column names
     """
-    client = get_client()
-    try:
-        sheet_name = st.secrets["spreadsheet"]["name"]
-        sh = client.open(sheet_name)
-        ws = sh.worksheet(worksheet_name)
-        
-        # Get headers to ensure correct order
-        headers = ws.row_values(1)
-        
-        # Prepare row values in order
-        row_values = []
-        for col in headers:
-            row_values.append(row_data.get(col, ""))
-            
-        ws.append_row(row_values)
-        
-        # Invalidate cache for this worksheet so UI updates immediately
-        load_data.clear()
-        
-        return True
-    except Exception as e:
-        st.error(f"Error adding row to {worksheet_name}: {e}")
-        return False
+    return add_rows(worksheet_name, [row_data])
@@ -0,0 +1,86 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from app.config import settings
+
+# Process-wide cache of photo analysis results (Gemini and YOLO), keyed on a
+# perceptual hash of the image, so re-uploading the same photo or clicking
+# "Analizar" again after a rerun answers instantly instead of sending the
+# image again.
+#
+# The hash is a 256-bit difference hash (dHash): the image is shrunk to 17x16
+# grayscale and each bit says whether a pixel is brighter than its right
+# neighbour. Only exact matches count (same namespace, i.e. which analyzer,
+# and same normalized context): two different meals on the same plate can be
+# only a few bits apart, and reusing the wrong meal's foods is worse than
+# paying for a new analysis.
+
+HASH_SIZE = 16
+
+_entries = OrderedDict()  # (namespace, context, hash) -> {"value", "created_at"}
+_stats = {"hits": 0, "misses": 0}
+_lock = threading.Lock()
+
+def image_hash(image):
+    """
+    256-bit dHash of a PIL image or numpy array.
+    """
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    small = np.asarray(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def normalize_context(user_context):
+    """
+    Case and whitespace don't change what the model is asked.
+    """
+    return " ".join(str(user_context or "").lower().split())
+
+def _expired(entry, now):
+    return now - entry["created_at"] > settings.IMAGE_CACHE_TTL_SECONDS
+
+def get(namespace, image_key, user_context=""):
+    """
+    Cached value for an image (image_key = image_hash()) analyzed with the
+    same namespace and context, or None. Returns a copy; callers may modify it.
+    """
+    key = (namespace, normalize_context(user_context), image_key)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or _expired(entry, time.time()):
+            _stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return copy.deepcopy(entry["value"])
+
+def put(namespace, image_key, value, user_context=""):
+    """
+    Stores a result, dropping expired entries and, past
+    IMAGE_CACHE_MAX_ENTRIES, the least recently used ones.
+    """
+    now = time.time()
+    with _lock:
+        _entries[(namespace, normalize_context(user_context), image_key)] = {
+            "value": copy.deepcopy(value),
+            "created_at": now,
+        }
+        for key in [key for key, entry in _entries.items() if _expired(entry, now)]:
+            del _entries[key]
+        while len(_entries) > settings.IMAGE_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+def stats():
+    """
+    Entry count and hit/miss counters, for diagnostics.
+    """
+    with _lock:
+        return {"entries": len(_entries), **_stats}
@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+import streamlit as st
+import pandas as pd
+from app.config import settings
+from app.services import schema
+
+# Same public API as google_sheets_service (init_sheets, load_data, load_many,
+# add_row, add_rows), backed by an embedded SQLite file. One table per worksheet.
+
+# Decoded, typed DataFrame per table, dropped on write. Callers always get a copy.
+_frames = {}
+_lock = threading.RLock()
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+@st.cache_resource
+def get_connection():
+    """
+    Opens the SQLite database once per process (WAL, shared across threads).
+    """
+    os.makedirs(os.path.dirname(settings.LOCAL_DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(settings.LOCAL_DB_PATH, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def get_lock():
+    """
+    Lock serializing statements on the shared connection (reentrant).
+    """
+    return _lock
+
+@contextmanager
+def transaction():
+    """
+    Runs a block as one write transaction on the shared connection.
+    """
+    conn = get_connection()
+    with _lock:
+        conn.execute("BEGIN")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+def _table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({_quote(table)})")]
+
+@st.cache_resource
+def _ensure_tables():
+    """
+    Creates one table per worksheet and adds any schema column it lacks.
+    Columns have no declared type so numbers and text round-trip as written.
+    """
+    conn = get_connection()
+    with _lock:
+        for table, cols in settings.SHEET_SCHEMAS.items():
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {_quote(table)} ({', '.join(_quote(c) for c in cols)})"
+            )
+            existing = _table_columns(conn, table)
+            for col in cols:
+                if col not in existing:
+                    conn.execute(f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(col)}")
+            # Legacy rows seeded from Sheets have an empty row_id
+            conn.execute(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {_quote(table + '_row_id')} "
+                f"ON {_quote(table)} ({_quote(settings.ROW_ID)}) WHERE {_quote(settings.ROW_ID)} != ''"
+            )
+    return True
+
+def init_sheets(force=False):
+    """
+    Initializes the local database. Runs once per process.
+    """
+    if force:
+        _ensure_tables.clear()
+    _ensure_tables()
+
+def _read_table(table):
+    cols = settings.SHEET_SCHEMAS.get(table)
+    if cols is None:
+        return pd.DataFrame()
+    query = f"SELECT {', '.join(_quote(c) for c in cols)} FROM {_quote(table)} ORDER BY rowid"
+    return schema.coerce(table, pd.read_sql_query(query, get_connection()))
+
+def load_many(worksheet_names):
+    """
+    Loads several tables and returns {worksheet_name: DataFrame}.
+    """
+    _ensure_tables()
+    result = {}
+    with _lock:
+        for name in dict.fromkeys(worksheet_names):
+            if name not in _frames:
+                try:
+                    _frames[name] = _read_table(name)
+                except Exception as e:
+                    print(f"Error loading {name}: {e}")
+                    result[name] = pd.DataFrame()
+                    continue
+            result[name] = _frames[name].copy()
+    return result
+
+def load_data(worksheet_name):
+    """
+    Loads a table into a pandas DataFrame.
+    """
+    return load_many([worksheet_name])[worksheet_name]
+
+def is_empty(worksheet_name):
+    _ensure_tables()
+    row = get_connection().execute(f"SELECT 1 FROM {_quote(worksheet_name)} LIMIT 1").fetchone()
+    return row is None
+
+def insert_rows(worksheet_name, rows, on_insert=None):
+    """
+    Inserts rows (dicts) into a table. Rows whose row_id is already stored
+    are skipped, so replaying the same write is harmless.
+    on_insert(conn, worksheet_name, inserted_rows) runs inside the same
+    transaction with only the rows actually stored (e.g. daily_rollup.apply_rows).
+    Raises on failure; add_rows() is the UI-facing wrapper.
+    """
+    _ensure_tables()
+    cols = settings.SHEET_SCHEMAS[worksheet_name]
+    rows = [dict(row_data) for row_data in rows]
+    for row_data in rows:
+        row_data.setdefault(settings.ROW_ID, uuid.uuid4().hex)
+
+    query = (
+        f"INSERT OR IGNORE INTO {_quote(worksheet_name)} ({', '.join(_quote(c) for c in cols)}) "
+        f"VALUES ({', '.join('?' for _ in cols)})"
+    )
+    try:
+        with transaction() as conn:
+            inserted = [
+                row_data for row_data in rows
+                if conn.execute(query, [row_data.get(col, "") for col in cols]).rowcount
+            ]
+            if on_insert is not None and inserted:
+                on_insert(conn, worksheet_name, inserted)
+    finally:
+        _frames.pop(worksheet_name, None)
+
+def add_rows(worksheet_name, rows, on_insert=None):
+    """
+    Appends several rows to the specified table in one transaction.
+    rows: list of dicts where keys match column names
+    """
+    try:
+        insert_rows(worksheet_name, rows, on_insert=on_insert)
+        return True
+    except Exception as e:
+        st.error(f"Error adding rows to {worksheet_name}: {e}")
+        return False
+
+def add_row(worksheet_name, row_data):
+    """
+    Appends a row to the specified table.
+    row_data: dict where keys match column names
+    """
+    return add_rows(worksheet_name, [row_data])
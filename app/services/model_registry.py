@@ -0,0 +1,128 @@
+import threading
+import time
+
+# Process-wide health registry for Gemini models, with one circuit breaker per
+# model. A model that keeps failing is skipped ("open") for a cooldown that
+# grows with each new failure; once the cooldown is over, a single request is
+# let through as a probe ("half-open") and its outcome closes or re-opens the
+# circuit. Errors that won't go away on their own (unknown model, unsupported
+# method) open the circuit for much longer.
+# The list_models() result is cached too, so discovery costs one call per TTL.
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+FAILURE_THRESHOLD = 2
+BASE_COOLDOWN_SECONDS = 30
+MAX_COOLDOWN_SECONDS = 30 * 60
+PERMANENT_COOLDOWN_SECONDS = 6 * 3600
+LIST_MODELS_TTL_SECONDS = 3600
+
+_lock = threading.Lock()
+_models = {}
+_listing = {"models": None, "fetched_at": 0.0}
+
+def _entry(model_name):
+    return _models.setdefault(model_name, {
+        "state": CLOSED,
+        "failures": 0,
+        "trips": 0,
+        "open_until": 0.0,
+        "probing": False,
+        "last_error": None,
+        "successes": 0,
+    })
+
+def is_permanent_error(error):
+    """
+    True for errors a retry won't fix (model unknown or unusable for this key).
+    """
+    text = str(error).lower()
+    return any(marker in text for marker in ("404", "not found", "not supported", "is not available"))
+
+def acquire(model_name):
+    """
+    Asks whether model_name may be called now. In half-open state only one
+    caller gets through (the probe); it must report back with
+    record_success() or record_failure(), or release() if it didn't call.
+    """
+    now = time.time()
+    with _lock:
+        entry = _entry(model_name)
+        if entry["state"] == OPEN and now >= entry["open_until"]:
+            entry["state"] = HALF_OPEN
+            entry["probing"] = False
+        if entry["state"] == CLOSED:
+            return True
+        if entry["state"] == HALF_OPEN and not entry["probing"]:
+            entry["probing"] = True
+            return True
+        return False
+
+def release(model_name):
+    """
+    Gives back an acquire() that didn't lead to a call: a half-open model
+    lets the next caller probe it instead.
+    """
+    with _lock:
+        _entry(model_name)["probing"] = False
+
+def record_success(model_name):
+    with _lock:
+        entry = _entry(model_name)
+        entry.update(state=CLOSED, failures=0, trips=0, probing=False, open_until=0.0)
+        entry["successes"] += 1
+
+def record_failure(model_name, error):
+    """
+    Counts a failed call; opens the circuit after FAILURE_THRESHOLD
+    consecutive failures, right away for a failed probe or a permanent error.
+    """
+    now = time.time()
+    with _lock:
+        entry = _entry(model_name)
+        entry["failures"] += 1
+        entry["last_error"] = str(error)[:300]
+        entry["probing"] = False
+        if is_permanent_error(error):
+            entry.update(state=OPEN, open_until=now + PERMANENT_COOLDOWN_SECONDS)
+            entry["trips"] += 1
+        elif entry["state"] == HALF_OPEN or entry["failures"] >= FAILURE_THRESHOLD:
+            cooldown = min(MAX_COOLDOWN_SECONDS, BASE_COOLDOWN_SECONDS * 2 ** entry["trips"])
+            entry.update(state=OPEN, open_until=now + cooldown)
+            entry["trips"] += 1
+
+def list_models(fetch):
+    """
+    Cached result of fetch() (e.g. the names from genai.list_models()).
+    A failed fetch is not cached and returns [].
+    """
+    with _lock:
+        if _listing["models"] is not None and time.time() - _listing["fetched_at"] < LIST_MODELS_TTL_SECONDS:
+            return list(_listing["models"])
+    try:
+        models = list(fetch())
+    except Exception as e:
+        print(f"Error listing Gemini models: {e}")
+        return []
+    with _lock:
+        _listing.update(models=models, fetched_at=time.time())
+    return list(models)
+
+def snapshot():
+    """
+    Current state of every known model, for diagnostics.
+    """
+    now = time.time()
+    with _lock:
+        return {
+            name: {
+                "state": entry["state"],
+                "failures": entry["failures"],
+                "successes": entry["successes"],
+                "retry_in_s": max(0, int(entry["open_until"] - now)) if entry["state"] == OPEN else 0,
+                "last_error": entry["last_error"],
+            }
+            for name, entry in _models.items()
+        }
@@ -1,7 +1,7 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
-from app.services import google_sheets_service as sheets
+from app.services import storage_service as storage
 from app.config import settings
 
 def get_user_profile():
@@ -12,7 +12,7 @@ def get_user_profile():
         
     # Try to load from sheets
     try:
-        df = sheets.load_data(settings.SHEET_PROFILE)
+        df = storage.load_data(settings.SHEET_PROFILE)
         if not df.empty:
             # Get latest profile
             latest = df.iloc[-1].to_dict()
@@ -43,7 +43,7 @@ def save_user_profile(profile):
     profile['updated_at'] = str(datetime.now())
     
     # Save to sheets
-    sheets.add_row(settings.SHEET_PROFILE, profile)
+    storage.add_row(settings.SHEET_PROFILE, profile)
     return True
 
 def calculate_bmr(weight, height, age, gender):
@@ -0,0 +1,76 @@
+import pandas as pd
+from app.config import settings
+
+# Parses worksheet frames once, at cache-fill time, against settings.SHEET_DTYPES,
+# so engines and pages get ready-to-use columns and cached frames stay compact.
+
+# Google Sheets counts days from 1899-12-30 (cells typed as dates in the Sheets UI
+# come back as serial numbers with UNFORMATTED_VALUE)
+SHEETS_EPOCH = "1899-12-30"
+
+def _parse_dates(values):
+    parsed = pd.to_datetime(values.astype(str), format=settings.DATE_FORMAT, errors="coerce")
+    serial = pd.to_numeric(values, errors="coerce")
+    if serial.notna().any():
+        from_serial = pd.to_datetime(serial, unit="D", origin=SHEETS_EPOCH, errors="coerce")
+        parsed = parsed.fillna(from_serial)
+    return parsed
+
+def _coerce_column(values, kind):
+    if kind == "date":
+        return _parse_dates(values)
+    if kind == "category":
+        return values.fillna("").astype(str).astype("category")
+    if kind == "bool":
+        return values.map(lambda v: str(v).strip().lower() in ("true", "1", "yes", "si", "sí"))
+    if kind.startswith("int"):
+        # Blank cells count as 0 (e.g. an empty amount_ml)
+        return pd.to_numeric(values, errors="coerce").fillna(0).astype(kind)
+    if kind.startswith("float"):
+        return pd.to_numeric(values, errors="coerce").astype(kind)
+    return values.fillna("").astype(str)
+
+def coerce(worksheet_name, df):
+    """
+    Returns df with every column cast to its declared type.
+    Columns without a declared type become plain strings.
+    """
+    if df.empty and df.columns.empty:
+        return df
+    dtypes = settings.SHEET_DTYPES.get(worksheet_name)
+    if dtypes is None:
+        return df
+    df = df.copy()
+    for col in df.columns:
+        df[col] = _coerce_column(df[col], dtypes.get(col, "str"))
+    return df
+
+def concat(worksheet_name, frame, new_frame):
+    """
+    Appends already-coerced rows to a coerced frame, keeping categoricals
+    categorical (a plain concat falls back to object when categories differ).
+    """
+    if frame.empty:
+        return new_frame
+    if new_frame.empty:
+        return frame
+    combined = pd.concat([frame, new_frame], ignore_index=True)
+    dtypes = settings.SHEET_DTYPES.get(worksheet_name, {})
+    for col, kind in dtypes.items():
+        if kind == "category" and col in combined.columns and combined[col].dtype != "category":
+            combined[col] = combined[col].astype("category")
+    return combined
+
+def to_records(df):
+    """
+    Inverse of coerce() for writing rows back to a store: dates as DATE_FORMAT
+    strings and blanks instead of NaN/NaT.
+    """
+    out = df.copy()
+    for col in out.columns:
+        if pd.api.types.is_datetime64_any_dtype(out[col]):
+            out[col] = out[col].dt.strftime(settings.DATE_FORMAT)
+        elif isinstance(out[col].dtype, pd.CategoricalDtype):
+            out[col] = out[col].astype(str)
+    out = out.astype(object).where(out.notna(), "")
+    return out.to_dict("records")
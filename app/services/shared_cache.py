@@ -0,0 +1,193 @@
+import io
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+import pandas as pd
+import streamlit as st
+from app.config import settings
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Second cache tier shared by every process/replica (the first tier is the
+# in-process cache of each service). Keys are plain strings, values bytes.
+# settings.SHARED_CACHE_URL selects the store:
+#   ""            -> SQLite file in DATA_DIR (share it via a mounted volume)
+#   "redis://..." -> Redis (or any Redis-compatible server)
+#   "off"         -> disabled
+
+class _SqliteTier:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, sqlite3.Binary(value), expires_at)
+            )
+            # Opportunistic cleanup so the file doesn't grow forever
+            self._conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    def get_counter(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def incr(self, key):
+        with self._lock:
+            # One write transaction, so the value read back is the one we set
+            # even with other processes incrementing the same counter
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO counters (key, value) VALUES (?, 1) "
+                    "ON CONFLICT(key) DO UPDATE SET value = value + 1",
+                    (key,)
+                )
+                value = self._conn.execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()[0]
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return value
+
+class _RedisTier:
+    def __init__(self, url):
+        self._client = redis.Redis.from_url(url, socket_timeout=2)
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(key, value, ex=int(ttl) if ttl else None)
+
+    def get_counter(self, key):
+        value = self._client.get(key)
+        return int(value) if value else 0
+
+    def incr(self, key):
+        return int(self._client.incr(key))
+
+@st.cache_resource
+def get_tier():
+    """
+    Returns the configured shared tier, or None if disabled/unavailable.
+    """
+    url = settings.SHARED_CACHE_URL
+    if url == "off":
+        return None
+    try:
+        if url.startswith(("redis://", "rediss://", "unix://")):
+            if redis is None:
+                print("SHARED_CACHE_URL points to Redis but the 'redis' package is not installed.")
+                return None
+            return _RedisTier(url)
+        return _SqliteTier(settings.SHARED_CACHE_PATH)
+    except Exception as e:
+        print(f"Shared cache unavailable: {e}")
+        return None
+
+def get(key):
+    """
+    Returns the bytes stored under key, or None (miss, expired or tier down).
+    """
+    tier = get_tier()
+    if tier is None:
+        return None
+    try:
+        return tier.get(key)
+    except Exception as e:
+        print(f"Shared cache get failed: {e}")
+        return None
+
+def put(key, value, ttl=None):
+    """
+    Stores bytes under key, optionally expiring after ttl seconds.
+    """
+    tier = get_tier()
+    if tier is None:
+        return
+    try:
+        tier.set(key, value, ttl)
+    except Exception as e:
+        print(f"Shared cache set failed: {e}")
+
+def get_version(name):
+    """
+    Current data version of a dataset (0 if never bumped).
+    """
+    tier = get_tier()
+    if tier is None:
+        return 0
+    try:
+        return tier.get_counter(f"version:{name}")
+    except Exception:
+        return 0
+
+def bump_version(name):
+    """
+    Marks every shared entry of a dataset as outdated (call after writes).
+    Returns the new version, or None if it couldn't be bumped.
+    """
+    tier = get_tier()
+    if tier is None:
+        return None
+    try:
+        return tier.incr(f"version:{name}")
+    except Exception as e:
+        print(f"Shared cache version bump failed: {e}")
+        return None
+
+def dumps_frame(df, meta=None):
+    """
+    Serializes a DataFrame (plus JSON metadata) to compact Parquet bytes.
+    Object columns must hold only strings (or missing values): a mixed column
+    (e.g. numbers and "" blanks) raises ValueError rather than coming back
+    with different types.
+    Layout: 4-byte meta length | meta JSON | payload.
+    """
+    meta = dict(meta or {}, format="parquet")
+    for col in df.select_dtypes(include="object").columns:
+        if not df[col].dropna().map(lambda v: isinstance(v, str)).all():
+            raise ValueError(f"Column {col!r} mixes strings with other types")
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    meta_bytes = json.dumps(meta, default=str).encode("utf-8")
+    return struct.pack(">I", len(meta_bytes)) + meta_bytes + buffer.getvalue()
+
+def loads_frame(data):
+    """
+    Inverse of dumps_frame(): returns (DataFrame, meta).
+    Anything but Parquet is refused: the bytes may come from a networked
+    store, and never get deserialized into arbitrary objects.
+    """
+    (meta_len,) = struct.unpack(">I", data[:4])
+    meta = json.loads(data[4:4 + meta_len].decode("utf-8"))
+    if meta.get("format") != "parquet":
+        raise ValueError(f"Unsupported shared cache format: {meta.get('format')}")
+    df = pd.read_parquet(io.BytesIO(data[4 + meta_len:]))
+    return df, meta
@@ -0,0 +1,112 @@
+import random
+import threading
+import time
+import gspread
+from app.config import settings
+
+# Process-wide token bucket in front of every Google Sheets API call.
+# The Sheets API allows ~60 requests/min per user; bursts from concurrent
+# sessions used to trip HTTP 429s. Interactive calls (page renders) may use
+# the whole bucket, background calls (journal flushes) must leave a reserve,
+# and any waiting interactive call goes first. 429s back off exponentially.
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+MAX_RETRIES = 5
+BASE_BACKOFF_SECONDS = 1
+MAX_BACKOFF_SECONDS = 32
+
+_cond = threading.Condition()
+_thread_priority = threading.local()
+_state = {
+    "tokens": float(settings.SHEETS_REQUESTS_PER_MINUTE),
+    "refilled_at": time.monotonic(),
+    "interactive_waiting": 0,
+}
+_stats = {"calls": 0, "throttled": 0, "retries": 0, "wait_s": 0.0}
+
+def set_thread_priority(priority):
+    """
+    Sets the default priority for Sheets calls made from the current thread.
+    """
+    _thread_priority.value = priority
+
+def _current_priority():
+    return getattr(_thread_priority, "value", INTERACTIVE)
+
+def _refill():
+    capacity = settings.SHEETS_REQUESTS_PER_MINUTE
+    now = time.monotonic()
+    elapsed = now - _state["refilled_at"]
+    _state["tokens"] = min(capacity, _state["tokens"] + elapsed * capacity / 60.0)
+    _state["refilled_at"] = now
+
+def _can_take(priority):
+    if priority == INTERACTIVE:
+        return _state["tokens"] >= 1
+    reserve = settings.SHEETS_REQUESTS_PER_MINUTE * settings.SHEETS_INTERACTIVE_RESERVE
+    return _state["interactive_waiting"] == 0 and _state["tokens"] >= 1 + reserve
+
+def _acquire(priority):
+    started = time.monotonic()
+    with _cond:
+        if priority == INTERACTIVE:
+            _state["interactive_waiting"] += 1
+        try:
+            while True:
+                _refill()
+                if _can_take(priority):
+                    _state["tokens"] -= 1
+                    break
+                # Sleep until roughly one token is back
+                _cond.wait(60.0 / settings.SHEETS_REQUESTS_PER_MINUTE)
+        finally:
+            if priority == INTERACTIVE:
+                _state["interactive_waiting"] -= 1
+                _cond.notify_all()
+        _stats["calls"] += 1
+        _stats["wait_s"] += time.monotonic() - started
+
+def _is_rate_limited(e):
+    return isinstance(e, gspread.exceptions.APIError) and e.code == 429
+
+def _throttle():
+    """
+    Empties the bucket after a 429 so other callers slow down too.
+    """
+    with _cond:
+        _refill()
+        _state["tokens"] = min(_state["tokens"], 0.0)
+        _stats["throttled"] += 1
+
+def call(fn, priority=None):
+    """
+    Runs fn() once a token is available, retrying HTTP 429 with exponential
+    backoff (with jitter). Other errors propagate unchanged.
+    """
+    if priority is None:
+        priority = _current_priority()
+
+    for attempt in range(MAX_RETRIES + 1):
+        _acquire(priority)
+        try:
+            return fn()
+        except Exception as e:
+            if not _is_rate_limited(e) or attempt == MAX_RETRIES:
+                raise
+            _throttle()
+            delay = min(BASE_BACKOFF_SECONDS * (2 ** attempt), MAX_BACKOFF_SECONDS)
+            delay *= random.uniform(0.5, 1.0)
+            with _cond:
+                _stats["retries"] += 1
+                _stats["wait_s"] += delay
+            time.sleep(delay)
+
+def stats():
+    """
+    Returns counters: calls, throttled (429s seen), retries, wait_s, tokens.
+    """
+    with _cond:
+        _refill()
+        return dict(_stats, wait_s=round(_stats["wait_s"], 3), tokens=round(_state["tokens"], 1))
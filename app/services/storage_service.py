@@ -0,0 +1,222 @@
+import time
+import uuid
+import streamlit as st
+import pandas as pd
+from app.config import settings
+from app.services import daily_rollup
+from app.services import local_store
+from app.services import schema
+from app.services import write_journal
+from app.services import google_sheets_service as sheets
+
+# Storage facade used by pages and engines.
+# settings.STORAGE_BACKEND picks the primary store; with the local store,
+# Google Sheets (when configured) becomes an asynchronous mirror.
+# Appends headed for Sheets go through write_journal (write-behind), except
+# with the Sheets backend on an ephemeral disk, where they are written directly.
+
+BOOTSTRAP_RETRY_SECONDS = 60
+
+_bootstrap = {"retry_at": 0.0}
+
+def _backend():
+    return sheets if settings.STORAGE_BACKEND == "sheets" else local_store
+
+def mirror_enabled():
+    """
+    True when writes to the local store should also be pushed to Google Sheets.
+    """
+    if settings.STORAGE_BACKEND == "sheets" or not settings.SHEETS_MIRROR:
+        return False
+    try:
+        return "gcp_service_account" in st.secrets
+    except Exception:
+        # No secrets at all: fully offline run
+        return False
+
+def _merge_pending(worksheet_name, df):
+    """
+    Adds journaled rows not yet flushed to Sheets, so reads see our own writes.
+    """
+    known_ids = set(df[settings.ROW_ID]) if settings.ROW_ID in df.columns else set()
+    pending = [
+        row_data for row_data in write_journal.pending_rows(worksheet_name)
+        if row_data.get(settings.ROW_ID) not in known_ids
+    ]
+    if not pending:
+        return df
+    columns = list(df.columns) if not df.empty else settings.SHEET_SCHEMAS.get(worksheet_name, [])
+    pending_df = pd.DataFrame([[row_data.get(col, "") for col in columns] for row_data in pending], columns=columns)
+    return schema.concat(worksheet_name, df, schema.coerce(worksheet_name, pending_df))
+
+@st.cache_resource
+def _init_seeded():
+    """
+    Creates the list of local tables already seeded from Google Sheets.
+    When it is new, tables that already have rows count as seeded (earlier
+    versions seeded only empty tables and never marked them).
+    """
+    with local_store.transaction() as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sheets_seeded'"
+        ).fetchone()
+        if not exists:
+            conn.execute("CREATE TABLE sheets_seeded (worksheet TEXT PRIMARY KEY)")
+            conn.executemany(
+                "INSERT INTO sheets_seeded (worksheet) VALUES (?)",
+                [(name,) for name in settings.ALL_SHEETS if not local_store.is_empty(name)]
+            )
+    return True
+
+def _unseeded():
+    _init_seeded()
+    seeded = {row[0] for row in local_store.get_connection().execute("SELECT worksheet FROM sheets_seeded")}
+    return [name for name in settings.ALL_SHEETS if name not in seeded]
+
+@st.cache_resource
+def _bootstrap_from_sheets():
+    """
+    Seeds local tables from Google Sheets (e.g. a fresh Cloud Run instance).
+    One batched read; a table counts as seeded only once it was actually
+    read, even if rows were written locally in the meantime (row ids keep
+    those from being imported twice). Raises if any worksheet couldn't be
+    read, so it is retried instead of cached.
+    """
+    pending = _unseeded()
+    if pending:
+        sheets.init_sheets()
+        frames = sheets.load_many(pending)
+        # load_many() returns an empty frame for worksheets it couldn't read
+        states = sheets.sync_states(pending, refresh=False)
+        failed = [name for name in pending if states[name] is None]
+        for name in pending:
+            if name in failed:
+                continue
+            if not frames[name].empty:
+                local_store.insert_rows(name, schema.to_records(frames[name]), on_insert=daily_rollup.apply_rows)
+            with local_store.transaction() as conn:
+                conn.execute("INSERT OR IGNORE INTO sheets_seeded (worksheet) VALUES (?)", (name,))
+        if failed:
+            raise RuntimeError(f"Could not read {', '.join(failed)} from Google Sheets")
+    return True
+
+def init_sheets(force=False):
+    """
+    Initializes the primary store (and seeds it from the Sheets mirror if empty).
+    Runs once per process; force=True re-checks everything.
+    """
+    _backend().init_sheets(force=force)
+    daily_rollup.init()
+    if settings.STORAGE_BACKEND == "sheets" or mirror_enabled():
+        # Resume draining anything left in the journal by a previous run
+        write_journal.start_worker()
+    if force:
+        daily_rollup.invalidate()
+    if mirror_enabled():
+        if force:
+            _bootstrap_from_sheets.clear()
+            _bootstrap["retry_at"] = 0.0
+        if time.time() >= _bootstrap["retry_at"]:
+            try:
+                _bootstrap_from_sheets()
+            except Exception as e:
+                # Not cached: retried on a later call
+                _bootstrap["retry_at"] = time.time() + BOOTSTRAP_RETRY_SECONDS
+                print(f"Error seeding local store from Google Sheets: {e}")
+
+def reset_connection():
+    """
+    Drops the pooled Google Sheets connection.
+    """
+    sheets.reset_connection()
+
+def load_many(worksheet_names):
+    """
+    Loads several worksheets and returns {worksheet_name: DataFrame}.
+    """
+    init_sheets()
+    frames = _backend().load_many(worksheet_names)
+    if settings.STORAGE_BACKEND == "sheets":
+        frames = {name: _merge_pending(name, df) for name, df in frames.items()}
+    return frames
+
+def load_data(worksheet_name):
+    """
+    Loads data from a specific worksheet into a pandas DataFrame.
+    """
+    return load_many([worksheet_name])[worksheet_name]
+
+def _rollup_versions():
+    """
+    With the Sheets backend the sheet can change under us (other replicas,
+    edits made directly in it): the rollup records what the last sync saw of
+    each source and is rebuilt when that changes (our own writes advance the
+    recorded state, see daily_rollup.advance). Expired entries are synced
+    first, so outside changes show up within CACHE_TTL_SECONDS.
+    The local store is only written through add_rows, so it never goes stale.
+    """
+    if settings.STORAGE_BACKEND != "sheets":
+        return {}
+    return sheets.sync_states(daily_rollup.SOURCES)
+
+def load_daily(start=None, end=None):
+    """
+    Per-day totals (calories, protein, carbs, fats, meals, water_ml,
+    water_logs, elite_completed, workout) indexed by day, optionally limited
+    to [start, end]. Served from the materialized rollup; the raw logs are
+    only read when it has to be (re)built.
+    """
+    init_sheets()
+    versions = _rollup_versions()
+    # A source Sheets couldn't load: keep the last rollup rather than an empty one
+    unreachable = None in versions.values() and daily_rollup.is_built()
+    if not unreachable and not daily_rollup.is_current(versions):
+        logs = load_many(daily_rollup.SOURCES)
+        daily_rollup.rebuild(*(logs[name] for name in daily_rollup.SOURCES), versions=versions)
+    return daily_rollup.load(start, end)
+
+def add_rows(worksheet_name, rows):
+    """
+    Appends several rows to the specified worksheet.
+    rows: list of dicts where keys match column names
+    Writes headed for Google Sheets are journaled and return immediately
+    when DATA_DIR is persistent; otherwise the Sheets backend writes
+    synchronously.
+    """
+    init_sheets()
+    # Assign ids up front so the local row and its mirrored copy match
+    rows = [dict(row_data) for row_data in rows]
+    for row_data in rows:
+        row_data.setdefault(settings.ROW_ID, uuid.uuid4().hex)
+
+    try:
+        if settings.STORAGE_BACKEND == "sheets":
+            if settings.DATA_DIR_PERSISTENT:
+                write_journal.enqueue(worksheet_name, rows)
+                daily_rollup.apply(worksheet_name, rows)
+            else:
+                # On an ephemeral disk the journal would be the only copy of
+                # the rows until flushed: write to Sheets before confirming
+                before = sheets.sync_states([worksheet_name], refresh=False)[worksheet_name]
+                sheets.append_rows(worksheet_name, rows)
+                daily_rollup.apply(worksheet_name, rows)
+                daily_rollup.advance(
+                    worksheet_name, before, sheets.sync_states([worksheet_name], refresh=False)[worksheet_name]
+                )
+            return True
+
+        # The daily rollup is updated in the same transaction as the log
+        ok = local_store.add_rows(worksheet_name, rows, on_insert=daily_rollup.apply_rows)
+        if ok and mirror_enabled():
+            write_journal.enqueue(worksheet_name, rows)
+        return ok
+    except Exception as e:
+        st.error(f"Error adding rows to {worksheet_name}: {e}")
+        return False
+
+def add_row(worksheet_name, row_data):
+    """
+    Appends a row to the specified worksheet.
+    row_data: dict where keys match column names
+    """
+    return add_rows(worksheet_name, [row_data])
@@ -1,7 +1,11 @@
+import time
 import streamlit as st
 from PIL import Image
 import numpy as np
+from app.config import settings
 from app.services import nutrition_db
+from app.services import image_cache
+from app.services import image_service
 
 try:
     from ultralytics import YOLO
@@ -11,6 +15,20 @@ except Exception as e:
     VISION_AVAILABLE = False
     IMPORT_ERROR = str(e)
 
+# image_cache namespace for YOLO detections
+CACHE_NAMESPACE = "yolov8n"
+
+# COCO classes that are food we know, and classes that usually sit around a
+# meal (a bowl or a table alone doesn't make a photo non-food)
+FOOD_CLASSES = {name for name in nutrition_db.FOOD_DB if name != "unknown"}
+TABLEWARE_CLASSES = {"bowl", "cup", "dining table", "fork", "knife", "spoon", "wine glass", "bottle"}
+MIN_DETECTION_CONFIDENCE = 0.3
+
+# Pre-filter decisions
+REJECT = "reject"
+LOCAL = "local"
+GEMINI = "gemini"
+
 @st.cache_resource
 def load_model():
     """
@@ -24,10 +42,97 @@ def load_model():
     model = YOLO('yolov8n.pt')
     return model
 
+def _open(image_file):
+    if isinstance(image_file, np.ndarray):
+        return Image.fromarray(image_file)
+    if isinstance(image_file, bytes):
+        # Already preprocessed (see image_service.preprocess_image)
+        return image_service.open_image(image_file)
+    if isinstance(image_file, Image.Image):
+        return image_file
+    return Image.open(image_file)
+
+def check_quality(img):
+    """
+    Quick photo quality check on a 256 px grayscale copy.
+    Returns the reason the photo is unusable (too dark or blurry), or None.
+    """
+    gray = img.convert("L")
+    gray.thumbnail((256, 256))
+    pixels = np.asarray(gray, dtype=np.float32)
+    if pixels.mean() < settings.PREFILTER_MIN_BRIGHTNESS:
+        return "La foto está demasiado oscura. Intenta con más luz."
+    # Variance of the Laplacian: low when there are no sharp edges
+    laplacian = (
+        pixels[:-2, 1:-1] + pixels[2:, 1:-1] + pixels[1:-1, :-2] + pixels[1:-1, 2:]
+        - 4 * pixels[1:-1, 1:-1]
+    )
+    if laplacian.var() < settings.PREFILTER_MIN_SHARPNESS:
+        return "La foto está borrosa. Enfoca el plato y vuelve a intentarlo."
+    return None
+
+def _quick_detections(img):
+    """
+    (class_name, confidence) of every YOLO detection, on a small input.
+    """
+    model = load_model()
+    results = model(img, imgsz=settings.PREFILTER_IMGSZ, verbose=False)
+    return [
+        (model.names[int(box.cls[0])], float(box.conf[0]))
+        for result in results
+        for box in result.boxes
+        if float(box.conf[0]) >= MIN_DETECTION_CONFIDENCE
+    ]
+
+def prefilter(image_file):
+    """
+    Local first stage of the meal scanner (see food_scanner).
+    Returns a dict: decision (REJECT, LOCAL or GEMINI), reason (for REJECT),
+    items (for LOCAL, same shape as the Gemini scanner's) and elapsed_ms.
+    - REJECT: too dark, blurry, or confident non-food detections only.
+    - LOCAL: a single food from nutrition_db, detected with high confidence
+      and nothing else on the table.
+    - GEMINI: everything else (mixed plates, dishes YOLO doesn't know, or
+      YOLO not installed).
+    """
+    start = time.perf_counter()
+    def verdict(decision, reason=None, items=None):
+        return {
+            "decision": decision,
+            "reason": reason,
+            "items": items or [],
+            "elapsed_ms": (time.perf_counter() - start) * 1000,
+        }
+
+    img = _open(image_file)
+    reason = check_quality(img)
+    if reason:
+        return verdict(REJECT, reason)
+    if not VISION_AVAILABLE:
+        return verdict(GEMINI)
+
+    try:
+        detections = _quick_detections(img)
+    except Exception as e:
+        print(f"YOLO pre-filter failed: {e}")
+        return verdict(GEMINI)
+
+    food = [(name, conf) for name, conf in detections if name in FOOD_CLASSES]
+    tableware = [name for name, _ in detections if name in TABLEWARE_CLASSES]
+    others = [conf for name, conf in detections if name not in FOOD_CLASSES and name not in TABLEWARE_CLASSES]
+
+    if not food and not tableware and others and max(others) >= settings.PREFILTER_REJECT_CONFIDENCE:
+        return verdict(REJECT, "No parece una foto de comida. Intenta con una foto de tu plato.")
+    if len(food) == 1 and not tableware and food[0][1] >= settings.PREFILTER_LOCAL_CONFIDENCE:
+        item = nutrition_db.build_item(food[0][0])
+        return verdict(LOCAL, items=[item])
+    return verdict(GEMINI)
+
 def detect_food(image_file):
     """
     Runs inference on the uploaded image.
     Returns a list of detected food items with their nutritional info.
+    Results are reused for the same photo (see image_cache).
     """
     if not VISION_AVAILABLE:
         st.error(f"⚠️ Error de sistema: No se pudo cargar el modelo de IA.\nDetalle: {IMPORT_ERROR}")
@@ -36,10 +141,16 @@ def detect_food(image_file):
     model = load_model()
     
     # Convert uploaded file to Image
-    if isinstance(image_file, (str, np.ndarray)):
+    if isinstance(image_file, np.ndarray):
         img = image_file
     else:
-        img = Image.open(image_file)
+        img = _open(image_file)
+
+    # Same photo already analyzed
+    image_key = image_cache.image_hash(img)
+    cached = image_cache.get(CACHE_NAMESPACE, image_key)
+    if cached is not None:
+        return cached
 
     # Run inference
     results = model(img)
@@ -69,4 +180,6 @@ def detect_food(image_file):
                 }
                 detected_items.append(item)
                 
-    return detected_items, results[0].plot() # Return items and annotated image
+    annotated = results[0].plot() # Annotated image
+    image_cache.put(CACHE_NAMESPACE, image_key, (detected_items, annotated))
+    return detected_items, annotated
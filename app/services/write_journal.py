@@ -0,0 +1,195 @@
+import atexit
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import streamlit as st
+from app.config import settings
+from app.services import daily_rollup
+from app.services import google_sheets_service as sheets
+from app.services import sheets_quota
+
+# Write-behind pipeline for Google Sheets appends.
+# Rows are first committed to a local append-only journal (SQLite), so the
+# caller returns immediately and nothing is lost if Sheets is slow or down.
+# A background worker drains the journal to Sheets in batches, retrying with
+# exponential backoff. Rows carry a row_id, so a replayed batch is harmless.
+#
+# The journal is only as durable as the disk under DATA_DIR: on a container's
+# ephemeral filesystem (Cloud Run without a volume) rows not yet flushed are
+# lost when the instance goes away. Pending rows are pushed on shutdown
+# (see flush_pending), and storage_service only relies on the journal as the
+# sole copy of a write when settings.DATA_DIR_PERSISTENT is set.
+
+BATCH_SIZE = 200
+IDLE_POLL_SECONDS = 5
+BASE_BACKOFF_SECONDS = 2
+MAX_BACKOFF_SECONDS = 300
+# Cloud Run allows 10 s between SIGTERM and SIGKILL
+SHUTDOWN_FLUSH_SECONDS = 8
+
+_lock = threading.Lock()
+# Only one flush at a time (worker or shutdown), so a batch is never sent twice
+_flush_lock = threading.Lock()
+_wakeup = threading.Event()
+
+@st.cache_resource
+def get_connection():
+    """
+    Opens the journal database once per process.
+    """
+    os.makedirs(os.path.dirname(settings.JOURNAL_DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(settings.JOURNAL_DB_PATH, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS journal (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            worksheet TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS journal_worksheet ON journal (worksheet)")
+    return conn
+
+def enqueue(worksheet_name, rows):
+    """
+    Durably records rows to be appended to a worksheet and wakes the worker.
+    rows must already carry their row_id.
+    """
+    now = time.time()
+    conn = get_connection()
+    with _lock:
+        conn.executemany(
+            "INSERT INTO journal (worksheet, payload, created_at) VALUES (?, ?, ?)",
+            [(worksheet_name, json.dumps(row_data, default=str), now) for row_data in rows]
+        )
+    start_worker()
+    _wakeup.set()
+
+def pending_rows(worksheet_name):
+    """
+    Rows journaled for a worksheet but not yet flushed to Sheets, oldest first.
+    """
+    with _lock:
+        cursor = get_connection().execute(
+            "SELECT payload FROM journal WHERE worksheet = ? ORDER BY id", (worksheet_name,)
+        )
+        return [json.loads(payload) for (payload,) in cursor]
+
+def stats():
+    """
+    Returns {"pending": n, "failing": n, "oldest_age_s": seconds}.
+    """
+    with _lock:
+        pending, failing, oldest = get_connection().execute(
+            "SELECT COUNT(*), SUM(attempts > 0), MIN(created_at) FROM journal"
+        ).fetchone()
+    return {
+        "pending": pending,
+        "failing": failing or 0,
+        "oldest_age_s": round(time.time() - oldest, 1) if oldest else 0,
+    }
+
+def _next_batch(due_before):
+    """
+    Oldest entries due before `due_before` of a single worksheet, so they
+    fit one append_rows call.
+    """
+    conn = get_connection()
+    with _lock:
+        first = conn.execute(
+            "SELECT worksheet FROM journal WHERE next_attempt_at <= ? ORDER BY id LIMIT 1", (due_before,)
+        ).fetchone()
+        if first is None:
+            return None, []
+        entries = conn.execute(
+            "SELECT id, payload, attempts FROM journal WHERE worksheet = ? AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+            (first[0], due_before, BATCH_SIZE)
+        ).fetchall()
+    return first[0], entries
+
+def _backoff(attempts):
+    delay = min(BASE_BACKOFF_SECONDS * (2 ** attempts), MAX_BACKOFF_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+def flush_once(ignore_backoff=False):
+    """
+    Pushes one batch to Sheets. Returns the number of rows flushed
+    (0 if there was nothing due or the batch failed).
+    ignore_backoff: also retry entries still waiting out a backoff.
+    """
+    with _flush_lock:
+        return _flush_batch(float("inf") if ignore_backoff else time.time())
+
+def _flush_batch(due_before):
+    worksheet_name, entries = _next_batch(due_before)
+    if not entries:
+        return 0
+
+    ids = [entry_id for entry_id, _, _ in entries]
+    rows = [json.loads(payload) for _, payload, _ in entries]
+    conn = get_connection()
+    before = sheets.sync_states([worksheet_name], refresh=False)[worksheet_name]
+    try:
+        sheets.append_rows(worksheet_name, rows)
+    except Exception as e:
+        attempts = max(a for _, _, a in entries) + 1
+        with _lock:
+            conn.executemany(
+                "UPDATE journal SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                [(attempts, time.time() + _backoff(attempts), str(e)[:500], entry_id) for entry_id in ids]
+            )
+        print(f"Error flushing {len(rows)} rows to {worksheet_name} (attempt {attempts}): {e}")
+        return 0
+
+    with _lock:
+        conn.executemany("DELETE FROM journal WHERE id = ?", [(entry_id,) for entry_id in ids])
+    # The rows were applied to the daily rollup when they were journaled
+    daily_rollup.advance(worksheet_name, before, sheets.sync_states([worksheet_name], refresh=False)[worksheet_name])
+    return len(rows)
+
+def flush_pending(timeout=SHUTDOWN_FLUSH_SECONDS):
+    """
+    Pushes everything still in the journal, backoffs included, giving up
+    after `timeout` seconds or at the first failed batch.
+    Returns the number of rows left.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if not flush_once(ignore_backoff=True):
+            break
+    left = stats()["pending"]
+    if left:
+        print(f"Write journal: {left} rows not flushed to Google Sheets")
+    return left
+
+def _worker_loop():
+    # Flushes yield to page renders in the Sheets quota scheduler
+    sheets_quota.set_thread_priority(sheets_quota.BACKGROUND)
+    while True:
+        _wakeup.clear()
+        try:
+            if flush_once():
+                continue  # keep draining while there is work
+        except Exception as e:
+            print(f"Write journal worker error: {e}")
+        _wakeup.wait(IDLE_POLL_SECONDS)
+
+@st.cache_resource
+def start_worker():
+    """
+    Starts the background drain thread once per process.
+    Entries left over from a previous run are picked up on start, and
+    whatever is pending is flushed when the process exits.
+    """
+    thread = threading.Thread(target=_worker_loop, name="sheets-journal", daemon=True)
+    thread.start()
+    # Streamlit turns SIGTERM into a normal interpreter exit, so this runs on scale-down
+    atexit.register(flush_pending)
+    return thread